@@ -1,42 +1,76 @@
-import os
 import re
 import sys
 import signal
 import logging
 import argparse
-import logging.config
 
+from pynetinstall.log import default_config, start_queue
 from pynetinstall.flash import FlashInterface, FatalError, AbortFlashing
 
 signal.signal(signal.SIGTERM, lambda sig, _: sys.exit(0))
 
 parser = argparse.ArgumentParser(__package__)
 parser.add_argument("-c", "--config", default="/etc/pynetinstall.ini", help="set location of configuration file")
-parser.add_argument("-i", "--interface", default="eth0", help="MAC or name of ethernet interface (name supported on Linux only)")
+parser.add_argument("-i", "--interface", nargs="+", default=["eth0"], help="MAC or name of ethernet interface(s) (name and several interfaces supported on Linux only)")
 parser.add_argument("-l", "--logging", default=None, help="python logging configuration")
 parser.add_argument("-v", "--verbose", action="count", default=0, help="enable verbose output")
 parser.add_argument("-1", "--oneshot", action="store_true", help="exit after flashing once")
+parser.add_argument("--device-address", default=None, metavar="HOST:PORT", help="talk to HOST:PORT instead of broadcasting (e.g. pynetinstall.emulator)")
+parser.add_argument("--cache", default=None, metavar="DIRECTORY", help="cache firmware downloaded over HTTP(S) in DIRECTORY")
+parser.add_argument("--cache-size", type=int, default=1024, metavar="MB", help="maximum size of the cache in MB")
+parser.add_argument("--kernel-filter", action="store_true", help="drop unrelated packets in the kernel (Linux only)")
+parser.add_argument("--transport", choices=("udp", "l2"), default="udp", help="broadcast UDP packets or send raw ethernet frames to each device (l2, Linux only)")
+parser.add_argument("-j", "--jobs", type=int, default=None, help="number of devices to flash at the same time (default: one per interface)")
+parser.add_argument("--metrics", default=None, metavar="[HOST:]PORT", help="serve metrics in the Prometheus text format on HOST:PORT (default host: 127.0.0.1)")
+parser.add_argument("--trace", default=None, metavar="FILE", help="append the events of each flash to FILE as JSON lines")
+parser.add_argument("--processes", action="store_true", help="flash each device in a worker process (Linux only)")
+parser.add_argument("--read-ahead", type=int, default=512, metavar="KB", help="how much of a file is read ahead while uploading, 0 to disable")
 args = parser.parse_args()
 
 # default to ERROR+WARNING, each -v increases the verbosity (INFO, DEBUG). must not set to NOTSET (0), or logger gets disabled.
 levels = sorted([e for e in logging._levelToName.keys() if e > 0], reverse=True)
 verbosity = levels[min(len(levels)-1, levels.index(logging.WARNING) + args.verbose)]
-if not args.logging:
-    args.logging = os.path.join(os.path.dirname(__file__), "logging.ini")
-logging.config.fileConfig(args.logging)
+if args.logging:
+    import logging.config
+    logging.config.fileConfig(args.logging)
+else:
+    # same as logging.ini, without parsing it
+    default_config()
+# write the log in a background thread, so a slow stderr never delays the packets
+start_queue()
 
-is_mac = re.fullmatch(r"([0-9a-f]{2}[:]?){6}", args.interface, re.I)
+is_mac = lambda interface: re.fullmatch(r"([0-9a-f]{2}[:]?){6}", interface, re.I)
 argdict = {
-    'mac_address' if is_mac else 'interface_name': args.interface,
+    'interface_name': [interface for interface in args.interface if not is_mac(interface)],
+    'mac_address': [interface for interface in args.interface if is_mac(interface)],
     'config_file': args.config,
     'log_level': verbosity,
+    'cache_dir': args.cache,
+    'cache_size': args.cache_size * 1024 ** 2,
+    'kernel_filter': args.kernel_filter,
+    'transport': args.transport,
+    'trace_file': args.trace,
+    'read_ahead': args.read_ahead * 1024,
 }
+if args.metrics:
+    host, _, port = args.metrics.rpartition(":")
+    argdict['metrics_address'] = (host or "127.0.0.1", int(port))
+if args.device_address:
+    host, _, port = args.device_address.rpartition(":")
+    argdict['device_address'] = (host, int(port))
+
+jobs = args.jobs or len(args.interface)
+if args.oneshot and len(args.interface) > 1:
+    parser.error("-1 supports only one interface")
 
 try:
     fl_dev = FlashInterface(**argdict)
 
     if args.oneshot:
         fl_dev.flash_once()
+    elif jobs > 1 or args.processes or len(fl_dev.connections) > 1:
+        # flash_until_stopped() only serves the first connection
+        fl_dev.flash_concurrently(jobs, processes=args.processes)
     else:
         fl_dev.flash_until_stopped()
 except FatalError as e:
@@ -0,0 +1,203 @@
+"""
+Benchmark the flashing process against `pynetinstall.emulator`
+
+Flashes emulated devices on localhost and prints one JSON object with the
+throughput of do_file(), the duration of each phase of Flasher.run(), the
+socket calls per chunk and the CPU time per MB of the flashing thread:
+
+    python -m pynetinstall.bench --size 12000000 --chunk-size 1452 --rtt 0.0005
+
+It also measures the cold start of a new interpreter (importing
+pynetinstall, configuring logging and loading the plugin) and its peak
+resident memory.
+
+With --min-throughput the exit status is 1 if the median throughput falls
+below the given bytes/s, with --max-startup if the median cold start takes
+longer than the given seconds, so CI can flag regressions.
+
+The socket calls are the sendto(), sendmsg() and recvfrom() calls of the
+connection, not the syscalls of the process: the poll() before each receive
+and any change of the socket timeout (fcntl/ioctl) are not counted. Run the
+benchmark under `strace -c -f` to see all of them.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import statistics
+
+from pynetinstall.log import Logger
+from pynetinstall.flash import Flasher
+from pynetinstall.network import UDPConnection
+from pynetinstall.emulator import Emulator, VirtualDevice
+
+# what the command line does before it waits for devices, see startup()
+STARTUP = ("import sys, logging;"
+           "from pynetinstall.log import Logger, default_config;"
+           "default_config();"
+           "from pynetinstall.flash import FlashInterface, load_plugin;"
+           "load_plugin(sys.argv[1], Logger(logging.WARNING))")
+
+# minimal header of a RouterOS 7.8 "system" package, see Flasher.verify_npk()
+NPK_HEADER = b"\x1e\xf1\xd0\xba" + bytes(16) + b"system".ljust(16, b"\0") + bytes([8, 102, 8, 7])
+
+
+class CountingConnection(UDPConnection):
+    """
+    UDPConnection that counts the socket calls sending and receiving packets
+    """
+    sends: int = 0
+    receives: int = 0
+
+    def sendto(self, *args, **kwargs):
+        self.sends += 1
+        return super().sendto(*args, **kwargs)
+
+    def sendmsg(self, *args, **kwargs):
+        self.sends += 1
+        return super().sendmsg(*args, **kwargs)
+
+    def recvfrom(self, *args, **kwargs):
+        self.receives += 1
+        return super().recvfrom(*args, **kwargs)
+
+
+class BenchFlasher(Flasher):
+    """
+    Flasher that measures the time spent in do_file()
+    """
+    file_time: float = 0.0
+    file_bytes: int = 0
+
+    def do_file(self, file, max_pos: int, file_name: str, digest: str = None) -> str:
+        started = time.monotonic()
+        result = super().do_file(file, max_pos, file_name, digest)
+        self.file_time += time.monotonic() - started
+        self.file_bytes += max_pos
+        return result
+
+
+def prepare(directory: str, size: int) -> str:
+    """
+    Write an NPK of `size` bytes and a pynetinstall.ini serving it to `directory`
+    """
+    npk = os.path.join(directory, "routeros-bench.npk")
+    with open(npk, "wb") as f:
+        f.write(NPK_HEADER)
+        f.write(os.urandom(max(0, size - len(NPK_HEADER))))
+    config = os.path.join(directory, "pynetinstall.ini")
+    with open(config, "w") as f:
+        f.write(f"[pynetinstall]\nfirmware={npk}\n")
+    return config
+
+
+def flash(config: str, chunk_size: int, rtt: float, format_delay: float, logger: Logger, loss: float = 0.0) -> dict:
+    """
+    Flash one emulated device and return the measurements
+    """
+    connection = CountingConnection(addr=("127.0.0.1", 0), mac_address="02:00:00:00:00:00", logger=logger, timeout=10,
+                                    device_addr=("127.0.0.1", 0))
+    device = VirtualDevice(b"\x02\0\0\0\0\x01", format_delay=format_delay, max_payload=max(chunk_size, 1452))
+    emulator = Emulator([device], ("127.0.0.1", 0), connection.getsockname(), latency=rtt / 2, loss=loss)
+    connection.device_addr = emulator.addr
+    emulator.start()
+    try:
+        flasher = BenchFlasher(connection, config_file=config, logger=logger)
+        flasher.CHUNK_SIZES = (chunk_size,)
+        flasher.accepted_chunk_sizes = {}
+        info = None
+        while not info:
+            info = connection.get_interface_info()
+        flasher.verify_npk(info)
+        sends, receives = connection.sends, connection.receives
+        cpu, started = time.thread_time(), time.monotonic()
+        flasher.run(info)
+        cpu, elapsed = time.thread_time() - cpu, time.monotonic() - started
+    finally:
+        emulator.stop()
+        connection.close()
+
+    chunks = flasher.pacer.chunks or 1
+    return {
+        "elapsed": elapsed,
+        "bytes": flasher.file_bytes,
+        "throughput": flasher.file_bytes / (flasher.file_time or 1),
+        "phases": flasher.timings,
+        "chunks": flasher.pacer.chunks,
+        "socket_calls_per_chunk": (connection.sends - sends + connection.receives - receives) / chunks,
+        "cpu_per_mb": cpu / (flasher.file_bytes / 1e6 or 1),
+        "pacer": flasher.pacer.stats(),
+        "retransmits": flasher.rto.retransmits,
+        "rto": flasher.rto.rto,
+    }
+
+
+def startup(config: str) -> dict:
+    """
+    Start a new interpreter that imports pynetinstall, configures logging and
+    loads the plugin of `config`, return its wall time and peak resident memory
+    """
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package, os.environ.get("PYTHONPATH")])))
+    started = time.monotonic()
+    pid = os.posix_spawn(sys.executable, [sys.executable, "-c", STARTUP, config], env)
+    _, status, usage = os.wait4(pid, 0)
+    elapsed = time.monotonic() - started
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f"Startup failed with exit status {os.waitstatus_to_exitcode(status)}")
+    # ru_maxrss is in kB on Linux, in bytes on macOS
+    max_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return {"elapsed": elapsed, "max_rss": max_rss}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser("pynetinstall.bench")
+    parser.add_argument("-s", "--size", type=int, default=4_000_000, help="size of the firmware in bytes")
+    parser.add_argument("-c", "--chunk-size", type=int, default=Flasher.MAX_BYTES, help="bytes per chunk")
+    parser.add_argument("-r", "--rtt", type=float, default=0.0, help="emulated round-trip time in seconds")
+    parser.add_argument("-f", "--format-delay", type=float, default=0.0, help="emulated format time in seconds")
+    parser.add_argument("-l", "--loss", type=float, default=0.0, help="emulated probability that a packet is lost")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="number of flashes to measure")
+    parser.add_argument("-o", "--output", default=None, help="write the JSON result to OUTPUT instead of stdout")
+    parser.add_argument("--min-throughput", type=float, default=None, help="exit with 1 if the median throughput (bytes/s) is lower")
+    parser.add_argument("--max-startup", type=float, default=None, help="exit with 1 if the median cold start (s) takes longer")
+    args = parser.parse_args()
+
+    logger = Logger(logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory:
+        config = prepare(directory, args.size)
+        starts = [startup(config) for _ in range(args.repeat)]
+        runs = [flash(config, args.chunk_size, args.rtt, args.format_delay, logger, args.loss) for _ in range(args.repeat)]
+
+    result = {
+        "parameters": {"size": args.size, "chunk_size": args.chunk_size, "rtt": args.rtt,
+                       "format_delay": args.format_delay, "loss": args.loss, "repeat": args.repeat},
+        "throughput": statistics.median(run["throughput"] for run in runs),
+        "socket_calls_per_chunk": statistics.median(run["socket_calls_per_chunk"] for run in runs),
+        "cpu_per_mb": statistics.median(run["cpu_per_mb"] for run in runs),
+        "retransmits": statistics.median(run["retransmits"] for run in runs),
+        "phases": {name: statistics.median(run["phases"][name] for run in runs) for name in runs[0]["phases"]},
+        "startup": {"elapsed": statistics.median(start["elapsed"] for start in starts),
+                    "max_rss": statistics.median(start["max_rss"] for start in starts)},
+        "runs": runs,
+    }
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.min_throughput is not None and result["throughput"] < args.min_throughput:
+        print(f"Throughput {result['throughput']:.0f} bytes/s is below {args.min_throughput:.0f} bytes/s", file=sys.stderr)
+        sys.exit(1)
+    if args.max_startup is not None and result["startup"]["elapsed"] > args.max_startup:
+        print(f"Startup {result['startup']['elapsed']:.3f}s is above {args.max_startup:.3f}s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+from pynetinstall.log import Logger
+from pynetinstall.httppool import HTTPPool
+from pynetinstall.source import url_file_name
+
+
+class FirmwareCache:
+    """
+    On-disk cache for firmware and configuration files served over HTTP(S)
+
+    Downloads are stored content-addressed by their SHA-256 digest in
+    `directory`/objects, the `index` maps each URL to the digest and the
+    validators (ETag, Last-Modified) of the response. Cached URLs are
+    revalidated with a conditional request on every use, so only the first
+    device (and the first after a change on the server) downloads the file.
+
+    Attributes
+    ----------
+
+    directory : str
+        Where the cache is stored
+    max_size : int
+        How many bytes the cached files may use, the least recently used are
+        evicted first (default: 1 GB)
+    index : dict[str, dict]
+        The cached URLs with their digest, validators, name and size
+    hits : int
+        How many requests were served from the cache
+    misses : int
+        How many requests had to download the file
+    http : HTTPPool
+        The connections the files are downloaded and revalidated over
+
+    Methods
+    -------
+
+    open(url) -> tuple[BufferedReader, str, int]
+        Open the file behind `url`, downloading it only if it changed
+
+    digest(url) -> str or None
+        The SHA-256 digest of the cached file of `url`
+
+    evict() -> None
+        Remove the least recently used files until the cache fits `max_size`
+    """
+    def __init__(self, directory: str, max_size: int = 1024 ** 3, logger: Logger = None, http: HTTPPool = None) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.logger = logger
+        self.http = HTTPPool(logger=logger) if http is None else http
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.url_locks: dict[str, threading.Lock] = {}
+        self.objects = os.path.join(directory, "objects")
+        os.makedirs(self.objects, exist_ok=True)
+        self.index_file = os.path.join(directory, "index.json")
+        try:
+            with open(self.index_file) as f:
+                self.index: dict[str, dict] = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def path(self, digest: str) -> str:
+        """
+        The path of the cached file with the SHA-256 `digest`
+        """
+        return os.path.join(self.objects, digest)
+
+    def digest(self, url: str) -> str or None:
+        """
+        The SHA-256 digest of the cached file of `url`, None if it is not cached
+        """
+        entry = self.index.get(url)
+        return entry["digest"] if entry else None
+
+    def open(self, url: str) -> tuple:
+        """
+        Open the file behind `url`, downloading it only if it is not cached or changed
+
+        Returns
+        -------
+
+         - BufferedReader: The cached file
+         - str: The name of the file
+         - int: The size of the file
+
+        Raises
+        ------
+
+        OSError
+            The file is not cached and can not be downloaded
+        """
+        from urllib.error import HTTPError, URLError
+
+        with self.lock:
+            url_lock = self.url_locks.setdefault(url, threading.Lock())
+        with url_lock:
+            entry = self.index.get(url)
+            if entry and not os.path.exists(self.path(entry["digest"])):
+                entry = None
+
+            headers = {}
+            if entry and entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry and entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+            try:
+                response = self.http.get(url, headers)
+            except HTTPError as e:
+                if e.code != 304 or not entry:
+                    raise
+                self.logger.debug("%s is not modified, using the cached file", url)
+                return self._hit(entry)
+            except URLError as e:
+                if not entry:
+                    raise
+                self.logger.info("Could not revalidate %s (%s), using the cached file", url, e.reason)
+                return self._hit(entry)
+
+            with response:
+                entry = self._download(url, response)
+            self.misses += 1
+            return open(self.path(entry["digest"]), "rb"), entry["name"], entry["size"]
+
+    def _hit(self, entry: dict) -> tuple:
+        """
+        Open a cached file and mark it as recently used
+        """
+        path = self.path(entry["digest"])
+        os.utime(path)
+        self.hits += 1
+        return open(path, "rb"), entry["name"], entry["size"]
+
+    def _download(self, url: str, response) -> dict:
+        """
+        Store the body of `response` and add it to the `index`
+
+        The file is written to a temporary file first and renamed to its
+        digest once it is complete, so a cached file is never partial.
+        """
+        self.logger.debug("Downloading %s to the cache", url)
+        digest = hashlib.sha256()
+        size = 0
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while block := response.read(64 * 1024):
+                    digest.update(block)
+                    f.write(block)
+                    size += len(block)
+            length = response.getheader("Content-Length")
+            if length is not None and int(length) != size:
+                raise OSError(f"incomplete download of {url} ({size} of {length} bytes)")
+            os.replace(temporary, self.path(digest.hexdigest()))
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+        entry = {
+            "digest": digest.hexdigest(),
+            "name": url_file_name(response.url, response),
+            "size": size,
+            "etag": response.getheader("ETag"),
+            "last_modified": response.getheader("Last-Modified"),
+        }
+        with self.lock:
+            self.index[url] = entry
+            self._save()
+        self.evict(keep=entry["digest"])
+        return entry
+
+    def _save(self) -> None:
+        """
+        Write the `index` to disk, replacing the previous one atomically
+        """
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.index, f)
+        os.replace(temporary, self.index_file)
+
+    def evict(self, keep: str = None) -> None:
+        """
+        Remove the least recently used files until the cache fits `max_size`
+
+        Arguments
+        ---------
+
+        keep : str
+            The digest of a file that must not be removed (default: None)
+        """
+        with self.lock:
+            files = []
+            for digest in os.listdir(self.objects):
+                stat = os.stat(self.path(digest))
+                files.append((stat.st_mtime, stat.st_size, digest))
+            total = sum(size for _, size, _ in files)
+            for _, size, digest in sorted(files):
+                if total <= self.max_size:
+                    break
+                if digest == keep:
+                    continue
+                os.unlink(self.path(digest))
+                total -= size
+                self.logger.debug("Evicted %s from the cache", digest)
+                for url in [url for url, entry in self.index.items() if entry["digest"] == digest]:
+                    del self.index[url]
+            self._save()
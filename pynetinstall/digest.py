@@ -0,0 +1,109 @@
+import os
+import json
+import fcntl
+import tempfile
+import threading
+
+
+def read_sidecar(path: str) -> str or None:
+    """
+    The SHA-256 digest in the file `path`.sha256 next to a local file, as
+    written by `sha256sum`, None if there is no such file
+    """
+    try:
+        with open(f"{path}.sha256") as f:
+            digest, *_ = f.readline().split() or [""]
+    except (OSError, UnicodeDecodeError):
+        return None
+    digest = digest.lower()
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        return None
+    return digest
+
+
+class DigestCache:
+    """
+    The SHA-256 digests of local files that were uploaded before, by their
+    path, modification time and size
+
+    A file that is uploaded again unchanged must have the same digest, so a
+    read error of the storage (e.g. a failing SD card) is noticed before the
+    device installs the file. With a `path` the digests are kept across
+    restarts. Worker processes sharing the `path` merge their digests into
+    the file under a lock (`path`.lock).
+
+    Attributes
+    ----------
+
+    path : str
+        The JSON file the digests are stored in, None to keep them in memory only
+    digests : dict[str, str]
+        The digests by key(), see key()
+
+    Methods
+    -------
+
+    key(file) -> str or None
+        The key of the local `file` in its current version
+
+    get(key) -> str or None
+        The digest of a key()
+
+    set(key, digest) -> None
+        Remember the digest of a key()
+    """
+    def __init__(self, path: str = None) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.digests: dict[str, str] = self._load() if path else {}
+
+    def _load(self) -> dict[str, str]:
+        """
+        The digests stored in the `path`, empty if it does not exist or can not be read
+        """
+        try:
+            with open(self.path) as f:
+                digests = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return digests if isinstance(digests, dict) else {}
+
+    def key(self, file: str) -> str or None:
+        """
+        The key of the local `file` from its absolute path, modification time
+        and size, None if it does not exist
+        """
+        try:
+            info = os.stat(file)
+        except OSError:
+            return None
+        return f"{os.path.abspath(file)}:{info.st_mtime_ns}:{info.st_size}"
+
+    def get(self, key: str) -> str or None:
+        """
+        The digest of the file version `key`, None if it was not uploaded before
+        """
+        return self.digests.get(key)
+
+    def set(self, key: str, digest: str) -> None:
+        """
+        Remember the `digest` of the file version `key` (and write the `path`)
+
+        The `path` is read again and written with the `digest` while the lock
+        file is held, so the digests other processes stored since are kept.
+        """
+        with self.lock:
+            if self.digests.get(key) == digest:
+                return
+            self.digests[key] = digest
+            if self.path:
+                with open(f"{self.path}.lock", "a") as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    digests = self._load()
+                    digests[key] = digest
+                    directory = os.path.dirname(os.path.abspath(self.path))
+                    fd, temporary = tempfile.mkstemp(dir=directory, suffix=".json")
+                    with os.fdopen(fd, "w") as f:
+                        json.dump(digests, f)
+                    os.replace(temporary, self.path)
+                self.digests.update(digests)
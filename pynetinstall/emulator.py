@@ -0,0 +1,326 @@
+"""
+Software Routerboard for testing pyNetinstall without real devices
+
+The emulator speaks the device side of the netinstall protocol over UDP,
+usually on localhost. Start it and point pyNetinstall at it:
+
+    python -m pynetinstall.emulator -n 4 --latency 0.001
+    python -m pynetinstall -i lo -c pynetinstall.ini --device-address 127.0.0.1:5001 -j 4
+"""
+import os
+import heapq
+import random
+import socket
+import struct
+import argparse
+import threading
+import time
+
+
+class VirtualDevice:
+    """
+    The device side of the netinstall protocol for one emulated Routerboard
+
+    Attributes
+    ----------
+
+    mac : bytes
+        The MAC Address of the device
+    model : str
+        The model the device announces
+    arch : str
+        The architecture the device announces
+    min_os : str
+        The lowest RouterOS version the device announces
+    lic_id : str
+        The license ID the device announces
+    lic_key : str
+        The license key the device announces
+    format_delay : float
+        Time in seconds the device needs to format before answering with STRT (default: 0.5)
+    max_payload : int
+        Chunks larger than this are dropped, like boot images with small receive buffers (default: 1452)
+    phase : str
+        Where the device is in the flashing process
+    files : dict[str, bytes]
+        The files received from the station
+    done : threading.Event
+        Set when the device was told to reboot (TERM)
+
+    Methods
+    -------
+
+    announce() -> bytes
+        The payload of the announcement of the device
+
+    receive(state, payload) -> list[tuple[float, bytes]]
+        Handle a packet of the station and return the delayed responses
+    """
+    def __init__(self, mac: bytes, model: str = "RB5009UG+S+", arch: str = "arm64", min_os: str = "7.1",
+                 lic_id: str = "", lic_key: str = "", format_delay: float = 0.5, max_payload: int = 1452) -> None:
+        self.mac = mac
+        self.model = model
+        self.arch = arch
+        self.min_os = min_os
+        self.lic_id = lic_id
+        self.lic_key = lic_key
+        self.format_delay = format_delay
+        self.max_payload = max_payload
+        self.phase = "announce"
+        self.files: dict[str, bytes] = {}
+        self.done = threading.Event()
+        self.last = None
+        self.upload = None
+
+    def announce(self) -> bytes:
+        """
+        The payload of the announcement, see `InterfaceInfo.from_data()`
+        """
+        return "\n".join(["", self.lic_id, self.lic_key, self.model, self.arch, self.min_os, ""]).encode()
+
+    def receive(self, state: tuple, payload: bytes) -> list[tuple[float, bytes]]:
+        """
+        Handle a packet of the station
+
+        Arguments
+        ---------
+
+        state : tuple
+            The state from the header of the packet
+        payload : bytes
+            The data of the packet
+
+        Returns
+        -------
+
+         - list[tuple[float, bytes]]: The responses to send and how long the
+           device needs before sending each (in addition to the latency)
+        """
+        if self.last and self.last[0] == state:
+            # retransmission of the previous packet, repeat the previous response
+            return self.last[1]
+        responses = self.handle(payload)
+        if responses is not None:
+            self.last = (state, responses)
+        return responses or []
+
+    def handle(self, payload: bytes) -> list[tuple[float, bytes]] or None:
+        """
+        Advance the flashing process, returns None if the packet was dropped
+        """
+        if self.phase == "announce" and payload.startswith(b"OFFR\n"):
+            self.phase = "offered"
+            return [(0, b"YACK\n")]
+        if self.phase == "offered" and not payload:
+            self.phase = "formatting"
+            return [(self.format_delay, b"STRT")]
+        if self.phase == "formatting" and not payload:
+            self.phase = "ready"
+            return [(0, b"RETR")]
+        if self.phase == "ready" and payload.startswith(b"FILE\n"):
+            _, name, *rest = payload.decode().split("\n")
+            if not name:
+                self.phase = "finished"
+                return [(0, b"WTRM")]
+            self.upload = (name, int(rest[0]), bytearray())
+            self.phase = "upload"
+            return [(0, b"RETR")]
+        if self.phase == "ready" and not payload:
+            return [(0, b"RETR")]
+        if self.phase == "upload":
+            if len(payload) > self.max_payload:
+                return None
+            name, size, data = self.upload
+            data += payload
+            if len(data) < size:
+                return [(0, b"RETR")]
+            self.files[name] = bytes(data)
+            self.phase = "ready"
+            # the station waits for the acknowledgement of the last chunk and another RETR
+            return [(0, b"RETR"), (0, b"RETR")]
+        if self.phase == "finished" and payload.startswith(b"TERM\n"):
+            self.phase = "rebooting"
+            self.done.set()
+            return []
+        return None
+
+
+class Emulator:
+    """
+    Emulates any number of `VirtualDevice`s on one UDP socket
+
+    The devices announce themselves to the `station` every
+    `announce_interval` seconds until they receive an offer.
+
+    Attributes
+    ----------
+
+    devices : dict[bytes, VirtualDevice]
+        The emulated devices by their MAC Address
+    station : tuple
+        The Address Pair of pyNetinstall (default: ("127.0.0.1", 5000))
+    latency : float
+        Time in seconds until a response arrives at the station (default: 0)
+    processing : float
+        Time in seconds the devices need to handle a packet (default: 0)
+    loss : float
+        Probability that a packet of the station is lost (default: 0)
+
+    Methods
+    -------
+
+    start() -> None
+        Run the emulator in a background thread
+
+    stop() -> None
+        Stop the emulator
+
+    wait(timeout=None) -> bool
+        Wait until all devices were flashed
+    """
+    def __init__(self, devices: list[VirtualDevice], addr: tuple = ("127.0.0.1", 5001), station: tuple = ("127.0.0.1", 5000),
+                 latency: float = 0.0, processing: float = 0.0, loss: float = 0.0, announce_interval: float = 0.5) -> None:
+        self.devices = {device.mac: device for device in devices}
+        self.station = station
+        self.latency = latency
+        self.processing = processing
+        self.loss = loss
+        self.announce_interval = announce_interval
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(addr)
+        self.addr = self.socket.getsockname()
+        self.station_mac = b"\0" * 6
+        self.queue = []
+        self.sequence = 0
+        self.running = False
+        self.thread = None
+
+    @classmethod
+    def with_devices(cls, count: int, *args, device_args: dict = None, **kwargs) -> object:
+        """
+        Create an Emulator with `count` devices with MAC Addresses 02:00:00:00:xx:xx
+        """
+        devices = [VirtualDevice(b"\x02\0\0\0" + struct.pack(">H", i + 1), **(device_args or {})) for i in range(count)]
+        return cls(devices, *args, **kwargs)
+
+    def send(self, device: VirtualDevice, state: tuple, payload: bytes, delay: float = 0) -> None:
+        """
+        Schedule a packet from `device` to the station
+        """
+        message = device.mac + self.station_mac + struct.pack("<HHHH", 0, len(payload), *state) + payload
+        self.sequence += 1
+        heapq.heappush(self.queue, (time.monotonic() + self.latency + delay, self.sequence, message))
+
+    def handle(self, data: bytes, addr: tuple) -> None:
+        """
+        Pass a packet of the station to the device it is addressed to
+        """
+        if len(data) < 20 or (self.loss and random.random() < self.loss):
+            return
+        device = self.devices.get(data[6:12])
+        if device is None:
+            return
+        self.station, self.station_mac = addr, data[0:6]
+        station_state = struct.unpack("<HH", data[16:20])
+        # the device answers with the counters of the station, see Flasher.do()
+        state = (station_state[1] + 1, station_state[0])
+        for delay, payload in device.receive(station_state, data[20:]):
+            self.send(device, state, payload, self.processing + delay)
+
+    def serve_forever(self) -> None:
+        """
+        Answer the packets of the station until stop() is called
+        """
+        self.running = True
+        next_announce = time.monotonic()
+        while self.running:
+            now = time.monotonic()
+            if now >= next_announce:
+                for device in self.devices.values():
+                    if device.phase == "announce":
+                        self.send(device, (1, 0), device.announce())
+                next_announce = now + self.announce_interval
+            while self.queue and self.queue[0][0] <= now:
+                _, _, message = heapq.heappop(self.queue)
+                self.socket.sendto(message, self.station)
+            timeout = next_announce - now
+            if self.queue:
+                timeout = min(timeout, self.queue[0][0] - now)
+            self.socket.settimeout(max(timeout, 0.0001))
+            try:
+                data, addr = self.socket.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.handle(data, addr)
+
+    def start(self) -> None:
+        """
+        Run the emulator in a background thread
+        """
+        self.thread = threading.Thread(target=self.serve_forever, name="emulator", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the emulator and close its socket
+        """
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        self.socket.close()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait until all devices were told to reboot, returns False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for device in self.devices.values():
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not device.done.wait(remaining):
+                return False
+        return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser("pynetinstall.emulator")
+    parser.add_argument("-n", "--devices", type=int, default=1, help="number of devices to emulate")
+    parser.add_argument("-b", "--bind", default="127.0.0.1:5001", metavar="HOST:PORT", help="address to listen on")
+    parser.add_argument("-s", "--station", default="127.0.0.1:5000", metavar="HOST:PORT", help="address of pynetinstall")
+    parser.add_argument("--latency", type=float, default=0.0, help="one-way latency of each packet in seconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="probability that a packet of pynetinstall is lost")
+    parser.add_argument("--processing", type=float, default=0.0, help="time in seconds a device needs to handle a packet")
+    parser.add_argument("--format-delay", type=float, default=0.5, help="time in seconds a device needs to format")
+    parser.add_argument("--max-payload", type=int, default=1452, help="drop chunks larger than this many bytes")
+    parser.add_argument("-o", "--output", default=None, help="write the received files to OUTPUT/<mac>/")
+    args = parser.parse_args()
+
+    def address(value):
+        host, _, port = value.rpartition(":")
+        return host, int(port)
+
+    emulator = Emulator.with_devices(args.devices, address(args.bind), address(args.station),
+                                     latency=args.latency, processing=args.processing, loss=args.loss,
+                                     device_args={"format_delay": args.format_delay, "max_payload": args.max_payload})
+    print(f"Emulating {args.devices} devices on {args.bind}")
+    emulator.start()
+    try:
+        emulator.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+    for device in emulator.devices.values():
+        print(f"{device.mac.hex(':')}: {device.phase}, " + ", ".join(f"{name} ({len(data)} bytes)" for name, data in device.files.items()))
+        if args.output:
+            directory = os.path.join(args.output, device.mac.hex("-"))
+            os.makedirs(directory, exist_ok=True)
+            for name, data in device.files.items():
+                with open(os.path.join(directory, os.path.basename(name)), "wb") as f:
+                    f.write(data)
+
+
+if __name__ == "__main__":
+    main()
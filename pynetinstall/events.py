@@ -0,0 +1,174 @@
+import os
+import json
+import time
+
+
+class Event:
+    """
+    Base class of the events a `Flasher` passes to its `hooks`
+
+    Attributes
+    ----------
+
+    name : str
+        The type of the event, as written by `JSONLinesSink`
+    mac : bytes
+        The MAC Address of the device
+    time : float
+        When the event occurred (time.monotonic())
+
+    Methods
+    -------
+
+    to_dict() -> dict
+        The event as a dict of JSON compatible values
+    """
+    name: str = "event"
+
+    def __init__(self, mac: bytes) -> None:
+        self.mac = mac
+        self.time = time.monotonic()
+
+    def to_dict(self) -> dict:
+        """
+        The event as a dict of JSON compatible values, with the `name`, the
+        `time`, the `mac` as a string and the attributes of the event type
+        """
+        fields = {key: value for key, value in vars(self).items() if key not in ("mac", "time")}
+        return {"event": self.name, "time": self.time, "mac": self.mac.hex(":"), **fields}
+
+
+class DeviceDiscovered(Event):
+    """
+    A device announced itself and is going to be flashed
+    """
+    name = "device_discovered"
+
+    def __init__(self, mac: bytes, model: str, arch: str, interface: str = None) -> None:
+        super().__init__(mac)
+        self.model = model
+        self.arch = arch
+        self.interface = interface
+
+
+class VerifyDone(Event):
+    """
+    The RouterOS package for the device was verified, see Flasher.verify_npk()
+    """
+    name = "verify_done"
+
+    def __init__(self, mac: bytes, file: str) -> None:
+        super().__init__(mac)
+        self.file = file
+
+
+class PhaseStart(Event):
+    """
+    A phase of the flash started (verify, offer, format, upload, finish)
+    """
+    name = "phase_start"
+
+    def __init__(self, mac: bytes, phase: str) -> None:
+        super().__init__(mac)
+        self.phase = phase
+
+
+class PhaseEnd(Event):
+    """
+    A phase of the flash ended successfully after `duration` seconds
+    """
+    name = "phase_end"
+
+    def __init__(self, mac: bytes, phase: str, duration: float) -> None:
+        super().__init__(mac)
+        self.phase = phase
+        self.duration = duration
+
+
+class FileStart(Event):
+    """
+    The upload of a file with `size` bytes started
+    """
+    name = "file_start"
+
+    def __init__(self, mac: bytes, file: str, size: int) -> None:
+        super().__init__(mac)
+        self.file = file
+        self.size = size
+
+
+class FileEnd(Event):
+    """
+    A file was uploaded, `sent` bytes in `chunks` chunks within `duration` seconds,
+    `sha256` is the digest of the uploaded bytes
+    """
+    name = "file_end"
+
+    def __init__(self, mac: bytes, file: str, size: int, sent: int, chunks: int, duration: float, sha256: str = None) -> None:
+        super().__init__(mac)
+        self.file = file
+        self.size = size
+        self.sent = sent
+        self.chunks = chunks
+        self.duration = duration
+        self.sha256 = sha256
+
+
+class ChunkAcked(Event):
+    """
+    The device acknowledged a chunk of `size` bytes after `rtt` seconds,
+    `retransmits` is how often it had to be sent again
+    """
+    name = "chunk_acked"
+
+    def __init__(self, mac: bytes, size: int, rtt: float, retransmits: int) -> None:
+        super().__init__(mac)
+        self.size = size
+        self.rtt = rtt
+        self.retransmits = retransmits
+
+
+class Aborted(Event):
+    """
+    The flash was aborted in `phase` because of `reason`
+    """
+    name = "aborted"
+
+    def __init__(self, mac: bytes, phase: str, reason: str) -> None:
+        super().__init__(mac)
+        self.phase = phase
+        self.reason = reason
+
+
+class JSONLinesSink:
+    """
+    A hook writing one JSON object per event to a file
+
+    Each line is appended with a single write() to a file opened with
+    O_APPEND, so worker processes can share the sink without interleaving
+    their lines.
+
+    Attributes
+    ----------
+
+    path : str
+        The file the events are appended to
+
+    Methods
+    -------
+
+    close() -> None
+        Close the file
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def __call__(self, event: Event) -> None:
+        os.write(self.fd, (json.dumps(event.to_dict()) + "\n").encode())
+
+    def close(self) -> None:
+        """
+        Close the file
+        """
+        os.close(self.fd)
@@ -1,24 +1,44 @@
 import io
+import os
+import hashlib
 import logging
 import sys
 import time
+import signal
+import threading
 import importlib
+import contextlib
 
 from io import BufferedReader
-from urllib import request
-from http.client import HTTPResponse
 from os.path import getsize, basename
 from configparser import ConfigParser
 
-from pynetinstall.log import Logger
+from pynetinstall.log import Logger, stop_queue
 from pynetinstall.interface import InterfaceInfo
-from pynetinstall.network import UDPConnection
+from pynetinstall.network import UDPConnection, L2Connection, Dispatcher, PipeQueue
+from pynetinstall.pacing import Pacer, RetransmitTimer
+from pynetinstall.cache import FirmwareCache
+from pynetinstall.digest import DigestCache, read_sidecar
+from pynetinstall.httppool import HTTPPool, PooledResponse
+from pynetinstall.metrics import Metrics
+from pynetinstall.events import Event, DeviceDiscovered, VerifyDone, PhaseStart, PhaseEnd, FileStart, FileEnd, ChunkAcked, Aborted, JSONLinesSink
+from pynetinstall.source import ReadAhead, MappedStore, is_regular_file, url_file_name
 from pynetinstall.plugins.simple import Plugin
+from pynetinstall.plugins.cached import CachedPlugin
 
 
 class AbortFlashing(Exception):
-    """ Abort the currently running flashing process. """
-    pass
+    """
+    Abort the currently running flashing process.
+
+    The `reason` is one of `REASONS`, the `metrics` count the aborted
+    flashes by it.
+    """
+    REASONS: tuple = ("timeout", "verify", "digest", "network", "plugin", "source", "protocol")
+
+    def __init__(self, message: str = "", reason: str = "protocol") -> None:
+        super().__init__(message)
+        self.reason = reason
 
 
 class FatalError(Exception):
@@ -26,6 +46,158 @@ class FatalError(Exception):
     pass
 
 
+def abort_reason(error: BaseException) -> str:
+    """
+    The reason label of an aborted flash, one of `AbortFlashing.REASONS`
+    or "error" for other exceptions
+    """
+    return error.reason if isinstance(error, AbortFlashing) else "error"
+
+
+def load_plugin(config_file: str, logger: Logger) -> Plugin:
+    """
+    Load the Plugin as configured in the `config_file`, see Flasher.load_config()
+    """
+    cparser = ConfigParser()
+    if not cparser.read(config_file):
+        raise FatalError(f"Configuration File ({config_file}) not found")
+    plugin = cparser.get("pynetinstall", "plugin", fallback="pynetinstall.plugins.simple:Plugin")
+    try:
+        mod, _, cls = plugin.partition(":")
+        if not cls:
+            cls = "Plugin"
+
+        plug = getattr(importlib.import_module(mod, __name__), cls)
+        logger.debug("The Plugin (%s) is successfully imported", plug)
+
+        try:
+            # attempt to initialize plugin with config
+            instance = plug(config=cparser)
+        except TypeError:
+            # if no custom __init__() was defined, no config will be available
+            instance = plug()
+    except Exception as e:
+        raise FatalError(f"Could not load {plugin}: {e} ({type(e).__name__})")
+
+    key = cparser.get("pynetinstall", "plugin_cache", fallback="")
+    if not key:
+        return instance
+    try:
+        instance = CachedPlugin(
+            instance,
+            key=[name.strip() for name in key.split(",") if name.strip()],
+            ttl=cparser.getfloat("pynetinstall", "plugin_cache_ttl", fallback=300),
+            max_entries=cparser.getint("pynetinstall", "plugin_cache_entries", fallback=1024),
+            logger=logger,
+        )
+    except ValueError as e:
+        raise FatalError(f"Invalid plugin cache configuration: {e}")
+    logger.debug("The files of the Plugin are cached by %s", ", ".join(instance.key))
+    return instance
+
+
+class PluginLoader:
+    """
+    Keeps the Plugin loaded from the `config_file` and loads it again when
+    the file changes, so the firmware can be swapped without a restart
+
+    The flashes acquire() the Plugin they use and release() it when they are
+    done. A replaced Plugin is closed (if it has a close() function) once
+    no flash uses it anymore.
+
+    Attributes
+    ----------
+
+    config_file : str
+        The configuration file the Plugin is loaded from
+    plugin : Plugin
+        The current Plugin, as loaded by the last acquire()
+    version : tuple
+        The modification time, size and inode of the `config_file` the `plugin` was loaded from
+
+    Methods
+    -------
+
+    acquire() -> Plugin
+        The current Plugin for a flash, loaded again if the `config_file` changed
+
+    release(plugin) -> None
+        The flash that acquired the `plugin` is done
+    """
+    def __init__(self, config_file: str, logger: Logger) -> None:
+        self.config_file = config_file
+        self.logger = logger
+        self.lock = threading.Lock()
+        # taken before loading, so a change while loading is picked up by the next acquire()
+        self.version = self._version()
+        self.plugin = load_plugin(config_file, logger)
+        # how many flashes use a Plugin, by its id()
+        self.users: dict[int, int] = {}
+        self.retired: dict[int, Plugin] = {}
+
+    def _version(self) -> tuple or None:
+        """
+        The modification time, size and inode of the `config_file`, None if it can not be read
+        """
+        try:
+            info = os.stat(self.config_file)
+        except OSError:
+            return None
+        return (info.st_mtime_ns, info.st_size, info.st_ino)
+
+    def acquire(self) -> Plugin:
+        """
+        The current Plugin for a flash, loaded again if the `config_file`
+        changed since it was loaded. The previous Plugin is kept if the file
+        was removed or the new configuration can not be loaded.
+
+        Called by the thread of the flash (loading may take a while), the
+        flash has to release() the Plugin when it is done.
+        """
+        version = self._version()
+        with self.lock:
+            if version is not None and version != self.version:
+                self.version = version
+                try:
+                    plugin = load_plugin(self.config_file, self.logger)
+                    self.logger.info("Reloaded the Plugin, %s changed", self.config_file)
+                except FatalError as e:
+                    self.logger.error("Keeping the previous Plugin, the changed %s can not be loaded: %s", self.config_file, e)
+                else:
+                    self.retired[id(self.plugin)] = self.plugin
+                    self._close_unused()
+                    self.plugin = plugin
+            self.users[id(self.plugin)] = self.users.get(id(self.plugin), 0) + 1
+            return self.plugin
+
+    def release(self, plugin: Plugin) -> None:
+        """
+        The flash that acquired the `plugin` is done, a replaced `plugin` is closed if no other flash uses it
+        """
+        with self.lock:
+            if self.users.get(id(plugin), 0) > 1:
+                self.users[id(plugin)] -= 1
+            else:
+                self.users.pop(id(plugin), None)
+            self._close_unused()
+
+    def _close_unused(self) -> None:
+        """
+        Close the replaced Plugins that are not used by a flash anymore, the lock has to be held
+        """
+        for key, plugin in list(self.retired.items()):
+            if key in self.users:
+                continue
+            del self.retired[key]
+            close = getattr(plugin, "close", None)
+            if close is None:
+                continue
+            try:
+                close()
+            except Exception as e:
+                self.logger.error("Closing the previous Plugin failed: %s (%s)", e, type(e).__name__)
+
+
 class Flasher:
     """
     Object to flash configurations on a Mikrotik Routerboard
@@ -43,15 +215,53 @@ class Flasher:
     info : InterfaceInfo
         Information about the Interface
     state : list
-        The current state of the flash (default: [0, 0])
+        The current state of the flash, separate for each Flasher (default: [0, 0])
     plugin : Plugin
         A Plugin to get the firmware and the configuration file 
         (Must include a .get_files(), has the Configuration as an attribute)
     logger : Logger
         Object to log LogRecords
+    cache : FirmwareCache
+        Cache for files served over HTTP(S), None to download them for every device
+    http : HTTPPool
+        The connections to HTTP(S) servers the files are downloaded over
+    files : tuple
+        The files returned by the `plugin` for the current device (None until requested)
+    opened : dict[int, tuple[ReadAhead, str, int]]
+        The files resolved by open_file(), by their index in `files`
+    prefetcher : threading.Thread
+        Resolves the remaining files while the device formats, see prefetch() (None if not running)
+    pacer : Pacer
+        Adapts the delay between the chunks of a file to how fast the device keeps up
+    rto : RetransmitTimer
+        How long to wait for a response before the last packet is sent again
+    sent : tuple[bytes, list]
+        The last packet sent by send() and its state, for retransmissions
+    timings : dict[str, float]
+        How many seconds each phase of the flash took (verify, offer, format, upload, finish)
+    metrics : Metrics
+        Where the flash records its counters and histograms, or None
+    hooks : list[callable]
+        Functions called with every `pynetinstall.events.Event` of the flash
     
     MAX_BYTES : int
-        How many bytes the connection can receive at once (default: 1024)
+        The smallest chunk size, accepted by every device (default: 1024)
+    CHUNK_SIZES : tuple[int]
+        The chunk sizes to probe at the start of the upload, largest first (default: (1452, 1280, 1024))
+    PROBE_TIMEOUT : float
+        Time in seconds to wait for the acknowledgement of a probed chunk (default: 2)
+    PROBE_RETRANSMITS : int
+        How often a probed chunk is sent again before it counts as dropped (default: 2)
+    MAX_RETRANSMITS : int
+        How often a packet is sent again before waiting for the rest of the timeout (default: 8)
+    READ_AHEAD : int
+        How many bytes of a file are read ahead in the background while uploading, 0 to disable (default: 512 kB)
+    PREFETCH_WORKERS : int
+        How many files prefetch() resolves and downloads at the same time (default: 4)
+    chunk_size : int
+        How many bytes are sent in one chunk, None until probed
+    accepted_chunk_sizes : dict[tuple[str, str], int]
+        The largest chunk size accepted by each (model, architecture), shared by all Flashers
 
     Methods
     -------
@@ -61,20 +271,62 @@ class Flasher:
     write(data) -> None
         Writes `data` over the Connection
 
-    read(mac=False) -> tuple[bytes, list] or tuple[bytes, list, bytes]
-        Read `data` from the Connection
+    send(data) -> None
+        Write `data` with the next state
+
+    read(timeout=None, retransmit=True) -> tuple[bytes, list]
+        Read `data` from the Connection, sending the last packet again if it is not answered
+
+    retransmit() -> None
+        Send the last packet again with the same state
 
     run(info=None) -> None
         The Flashing Process
 
+    phase(name) -> contextmanager
+        Measure how long a phase of the Flashing Process takes
+
+    emit(event) -> None
+        Pass an `Event` to the `hooks`
+
     do(data, response=None) -> None
         Execute one step of the Flashing  Process
 
-    do_file(file, max_pos, file_name) -> None
-        Send a `file` over the Connection
+    do_file(file, max_pos, file_name, digest=None) -> str
+        Send a `file` over the Connection, checking its SHA-256 `digest`
+
+    probe_chunk_size(data) -> int
+        Send the first chunk with the largest size the device accepts
+
+    probe_chunk(data) -> bool
+        Send a chunk of probe_chunk_size() and retransmit it until it is acknowledged
     
     do_files() -> None
         Get the files from the `plugin` and execute do_file() for every file
+
+    upload(file, size, name, index=None) -> None
+        Execute do_file() with the expected digest and close the file
+
+    get_files(info) -> tuple
+        Get the files for the device from the `plugin` (once per flash)
+
+    open_file(index, spool=False) -> tuple[ReadAhead, str, int]
+        Resolve a file of get_files() (once per flash)
+
+    expect_digest(index) -> None
+        Look up the SHA-256 digest a file of get_files() must have
+
+    prefetch() -> None
+        Resolve the files of get_files() not opened yet in the background
+
+    wait_prefetch() -> None
+        Wait until the files of prefetch() are resolved
+
+    close_files() -> None
+        Close all files opened by open_file()
+
+    map_files(store, info=None) -> None
+        Resolve all files of get_files() into memory mapped by the `store`
     
     wait() -> None
         Wait for something
@@ -86,9 +338,18 @@ class Flasher:
     info: InterfaceInfo
     state: list = [0, 0]
     MAX_BYTES: int = 1024
+    # an ethernet frame (MTU 1500) fits 1452 bytes after the IP, UDP and netinstall headers
+    CHUNK_SIZES: tuple = (1452, 1280, MAX_BYTES)
+    PROBE_TIMEOUT: float = 2
+    PROBE_RETRANSMITS: int = 2
+    MAX_RETRANSMITS: int = 8
+    READ_AHEAD: int = 512 * 1024
+    PREFETCH_WORKERS: int = 4
+    accepted_chunk_sizes: dict = {}
 
     def __init__(self, connection: UDPConnection, config_file: str = "config.ini",
-                 logger: Logger = None) -> None:
+                 logger: Logger = None, cache: FirmwareCache = None, plugin: Plugin = None, metrics: Metrics = None,
+                 hooks: list = None, http: HTTPPool = None, digests: DigestCache = None, read_ahead: int = None) -> None:
         """
         Initialization of a new Flasher
         
@@ -98,16 +359,52 @@ class Flasher:
         Arguments
         ---------
 
-        connection : UDPConnection
-            The Connection object to reuse from flash_once or flash_until_stopped.
+        connection : UDPConnection or DeviceChannel
+            The Connection object to reuse from flash_once or flash_until_stopped,
+            or the channel of the device when flashing concurrently.
         config_file : str
             The location of the configuration file (default: config.ini)
         logger : Logger
             Object to log LogRecords
+        cache : FirmwareCache
+            Cache for files served over HTTP(S) (default: None)
+        plugin : Plugin
+            A Plugin shared by several Flashers, loaded from the `config_file` if None (default: None)
+        metrics : Metrics
+            Where to record the counters and histograms of the flash (default: None)
+        hooks : list[callable]
+            Functions to call with the events of the flash (default: None)
+        http : HTTPPool
+            Connections to HTTP(S) servers shared by several Flashers, a new pool if None (default: None)
+        digests : DigestCache
+            The digests of local files uploaded before, to check them again (default: None)
+        read_ahead : int
+            How many bytes of a file are read ahead while uploading, `READ_AHEAD` if None (default: None)
         """
         self.logger = logger
         self.logger.debug("Initialization of a new Flasher object")
-        self.plugin = self.load_config(config_file)
+        self.cache = cache
+        self.http = HTTPPool(logger=logger) if http is None else http
+        self.metrics = metrics
+        self.hooks = list(hooks or [])
+        self.files = None
+        self.digests = digests
+        if read_ahead is not None:
+            self.READ_AHEAD = read_ahead
+        self.opened = {}
+        self.expected = {}
+        self.digest_keys = {}
+        self.prefetcher = None
+        self.prefetch_error = None
+        self.state = [0, 0]
+        self.pacer = Pacer()
+        self.rto = RetransmitTimer()
+        self.sent = None
+        self.sent_at = 0.0
+        self.retransmits = 0
+        self.chunk_size = None
+        self.timings = {}
+        self.plugin = self.load_config(config_file) if plugin is None else plugin
         self.conn = connection
 
     def load_config(self, config_file: str = "config.ini") -> Plugin:
@@ -131,53 +428,49 @@ class Flasher:
         FileNotFoundError
             If the `config_file` does not exist or is not found
         """
-        
-        cparser = ConfigParser()
-        if not cparser.read(config_file):
-            raise FatalError(f"Configuration File ({config_file}) not found")
-        try:
-            plugin = cparser.get("pynetinstall", "plugin", fallback="pynetinstall.plugins.simple:Plugin")
-            mod, _, cls = plugin.partition(":")
-            if not cls:
-                cls = "Plugin"
-
-            plug = getattr(importlib.import_module(mod, __name__), cls)
-            self.logger.debug(f"The Plugin ({plug}) is successfully imported")
-
-            try:
-                # attempt to initialize plugin with config
-                return plug(config=cparser)
-            except TypeError:
-                # if no custom __init__() was defined, no config will be available
-                return plug()
-        except Exception as e:
-            raise FatalError(f"Could not load {plug.__module__}.{plug.__name__}: {e} ({type(e).__name__})")
+        return load_plugin(config_file, self.logger)
 
     def verify_npk(self, info: InterfaceInfo) -> None:
         """
         Checks that the RouterOS file the plugin returned is valid to avoid
         formatting the Routerboard without being able to install an OS.
         """
-        npk, *_ = self.plugin.get_files(info)
-        if npk is None:
-            raise AbortFlashing("Verification failed: Plugin did not return RouterOS.")
+        self.info = info
+        with self.phase("verify"):
+            npk, *_ = self.get_files(info)
+            if npk is None:
+                raise AbortFlashing("Verification failed: Plugin did not return RouterOS.", "plugin")
 
-        npk_file, _, _ = self.resolve_file_data(npk)
-        header = npk_file.read(40)
+            # the header is peeked from the stream that do_files() uploads later, so the file is only fetched once
+            npk_file, npk_file_name, _ = self.open_file(0)
+            try:
+                self.check_npk_header(npk_file.peek(40), info)
+            except AbortFlashing:
+                self.close_files()
+                raise
+        if self.hooks:
+            self.emit(VerifyDone(info.mac, npk_file_name))
+        # the other files are resolved while the device formats
+        self.prefetch()
+
+    def check_npk_header(self, header: bytes, info: InterfaceInfo) -> None:
+        """
+        Checks the first 40 bytes of the RouterOS file, see verify_npk()
+        """
+        if len(header) < 40:
+            raise AbortFlashing(f"Verification failed: RouterOS file is too short ({len(header)} bytes).", "verify")
         if header[0:4] != b'\x1e\xf1\xd0\xba': # npk magic bytes 0x1EF1D0BA (via binwalk)
-            raise AbortFlashing("Verification failed: RouterOS file does not look like an NPK.")
+            raise AbortFlashing("Verification failed: RouterOS file does not look like an NPK.", "verify")
 
         package = header[0x14:0x24].rstrip(b'\x00').decode()
         if package != "system":
-            raise AbortFlashing("Verification failed: First NPK file must be 'system' (RouterOS), extra package {package!r} supplied instead.")
+            raise AbortFlashing(f"Verification failed: First NPK file must be 'system' (RouterOS), extra package {package!r} supplied instead.", "verify")
 
         # extract version number. release_type is lowercase ASCII letter 'a'=alpha, 'b'=beta, 'c'=candidate, 'f'=final, other values are plain uint8
         patch, release_type, minor, major = header[0x24:0x28]
-        if map(int, info.min_os.split(".")) > (major, minor, patch):
+        if tuple(map(int, info.min_os.split("."))) > (major, minor, patch):
             release = {97: 'alpha', 98: 'beta', 99: 'rc', 102: ''}.get(release_type, '<unknown release type>')
-            raise AbortFlashing(f"Verification failed: Tried to install RouterOS {major}.{minor}.{release}{patch}, but device requires at least {info.min_os}.")
-
-        npk_file.close()
+            raise AbortFlashing(f"Verification failed: Tried to install RouterOS {major}.{minor}.{release}{patch}, but device requires at least {info.min_os}.", "verify")
 
     def write(self, data: bytes) -> None:
         """
@@ -193,24 +486,77 @@ class Flasher:
         """
         self.conn.write(data, self.state, self.info.mac)
 
-    def read(self) -> tuple[bytes, list]:
+    def send(self, data: bytes) -> None:
+        """
+        Write the `data` with the next state and remember it for retransmit()
+
+        The device answers with both counters of the packet, so the response
+        is expected with the state after send().
+        """
+        self.state[1] += 1
+        self.sent, self.sent_at, self.retransmits = (data, self.state.copy()), time.monotonic(), 0
+        self.write(data)
+        self.state[0] += 1
+
+    def retransmit(self) -> None:
+        """
+        Send the last packet of send() again with the same state
+
+        The device ignores a packet with a state it already handled and only
+        repeats its response, so a retransmission never advances the flash.
+        """
+        data, state = self.sent
+        self.retransmits += 1
+        self.rto.backoff()
+        if self.metrics:
+            self.metrics.inc("pynetinstall_retransmits_total")
+        self.logger.debug("No response to state %s, sending it again (retransmission timeout %.0fms)", state, self.rto.rto * 1000)
+        self.conn.write(data, state, self.info.mac)
+
+    def read(self, timeout: float = None, retransmit: bool = True) -> tuple[bytes, list]:
         """
         Read `data` from the UDPConnection
         
         This function is used to pass the value of `state` and `dev_mac` 
         to the read function of the connection.
 
+        A lost packet (or response) would block until the `timeout`, so the
+        last packet of send() is sent again whenever the response takes longer
+        than the retransmission timeout `rto`, at most `MAX_RETRANSMITS` times.
+
+        Arguments
+        ---------
+
+        timeout : float
+            Time in seconds to wait for the response (default: the timeout of the connection)
+        retransmit : bool
+            Whether the last packet may be sent again, not while the device is busy (default: True)
+
         Returns
         -------
 
          - bytes: The Data received (Without the first 6 bytes where the Interface MAC is displayed)
          - list: The Position the Interface returned
         """
-        try:
-            data = self.conn.read(self.state)
-        except TimeoutError as e:
-            raise AbortFlashing(f"Device did not respond")
-        return data
+        if timeout is None:
+            timeout = self.conn.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        retransmit = retransmit and self.sent is not None
+        while True:
+            wait = None if deadline is None else deadline - time.monotonic()
+            retry = retransmit and self.retransmits < self.MAX_RETRANSMITS
+            if retry:
+                wait = self.rto.rto if wait is None else min(wait, self.rto.rto)
+            try:
+                data = self.conn.read(self.state, timeout=wait)
+            except TimeoutError:
+                if not retry or (deadline is not None and time.monotonic() >= deadline):
+                    raise AbortFlashing("Device did not respond", "timeout")
+                self.retransmit()
+                continue
+            if retransmit and not self.retransmits and data[0] is not None:
+                self.rto.sample(time.monotonic() - self.sent_at)
+            return data
 
     def run(self, info: InterfaceInfo) -> None:
         """
@@ -226,34 +572,83 @@ class Flasher:
          6.  Restarts the board
         """
         self.info = info
-        # Offer the flash
-        self.logger.debug("Sending the offer to flash")
         try:
-            self.state = [0, 0]
-            self.do(f"OFFR\n{info.lic_key}\n\n\n\0".encode(), b"YACK\n")
-        # Errno 101 Network is unreachable
-        except OSError as e:
-            raise AbortFlashing(f"Network error: {e}")
-        # Format the board
-        self.logger.info(f"Formatting {info.mac.hex(':')} ...")
-        self.do(b"", b"STRT")
-        # Spacer to give the board some time to prepare for the file
-        self.logger.debug("Waiting until the Board is ready to receive the file")
-        self.do(b"", b"RETR")
-        # Send the files
-        self.logger.debug("Sending the Files to the Board")
-        self.do_files()
-        # Tell the board that the installation is done
-        self.logger.debug("Installation Done")
-        self.do(b"FILE\n", b"WTRM")
-        # Tell the board that it can now reboot and load the files
-        self.logger.debug("Rebooting the Board")
-        self.do(b"TERM\n")
-
-        self.logger.info(f"{info.mac.hex(':')} was successfully flashed.")
+            # Offer the flash
+            self.logger.debug("Sending the offer to flash")
+            with self.phase("offer"):
+                try:
+                    self.state = [0, 0]
+                    self.do(f"OFFR\n{info.lic_key}\n\n\n\0".encode(), b"YACK\n")
+                # Errno 101 Network is unreachable
+                except OSError as e:
+                    raise AbortFlashing(f"Network error: {e}", "network")
+            # Format the board
+            self.logger.info("Formatting %s ...", info.mac.hex(':'))
+            with self.phase("format"):
+                # the device answers after formatting, which takes longer than any retransmission timeout
+                self.do(b"", b"STRT", retransmit=False)
+                # Spacer to give the board some time to prepare for the file
+                self.logger.debug("Waiting until the Board is ready to receive the file")
+                self.do(b"", b"RETR")
+            # Send the files
+            self.logger.debug("Sending the Files to the Board")
+            with self.phase("upload"):
+                self.do_files()
+        finally:
+            # also closes the files verify_npk() and prefetch() opened if the offer or the format failed
+            self.close_files()
+        with self.phase("finish"):
+            # Tell the board that the installation is done
+            self.logger.debug("Installation Done")
+            self.do(b"FILE\n", b"WTRM")
+            # Tell the board that it can now reboot and load the files
+            self.logger.debug("Rebooting the Board")
+            self.do(b"TERM\n")
+
+        self.logger.info("%s was successfully flashed.", info.mac.hex(':'))
+        if self.metrics:
+            self.metrics.inc("pynetinstall_flashes_succeeded_total")
         return
 
-    def do(self, data: bytes, response: bytes = None) -> None:
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """
+        Measure how long a phase of the flash takes and store it in `timings`,
+        the `metrics` count the flash as aborted in this phase if it raises
+        (by the reason of an AbortFlashing, see abort_reason())
+        """
+        if self.hooks:
+            self.emit(PhaseStart(self.info.mac, name))
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            if self.metrics:
+                self.metrics.inc("pynetinstall_flashes_aborted_total", phase=name, reason=abort_reason(e))
+            if self.hooks:
+                self.emit(Aborted(self.info.mac, name, str(e) or type(e).__name__))
+            raise
+        finally:
+            self.timings[name] = time.monotonic() - started
+        if self.metrics:
+            self.metrics.observe("pynetinstall_phase_duration_seconds", self.timings[name], phase=name)
+        if self.hooks:
+            self.emit(PhaseEnd(self.info.mac, name, self.timings[name]))
+
+    def emit(self, event: Event) -> None:
+        """
+        Pass the `event` to the `hooks`, a failing hook does not abort the flash
+
+        Firing an event costs nothing but the check of `hooks` when none are
+        registered, so events are only created inside `if self.hooks:`.
+        """
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception as e:
+                self.logger.error(f"Hook {hook!r} failed on {event.name}: {e} ({type(e).__name__})")
+
+    def do(self, data: bytes, response: bytes = None, retransmit: bool = True) -> None:
         """
         Execute steps from the Flashing Process
 
@@ -264,17 +659,17 @@ class Flasher:
             The Data to send to the Interface
         response : bytes
             What to expect as a Response from the Interface (default: None)
+        retransmit : bool
+            Whether `data` is sent again if the response is late, see read() (default: True)
         """
-        self.logger.debug(f"Executing the {data} command")
-        self.state[1] += 1
-        self.write(data)
-        self.state[0] += 1
+        self.logger.debug("Executing the %s command", data)
+        self.send(data)
 
         if response is None:
             return True
         else:
-            self.logger.debug(f"Waiting for the Response {response}")
-            res, new_state = self.read()
+            self.logger.debug("Waiting for the Response %s", response)
+            res, new_state = self.read(retransmit=retransmit)
             if res is None:
                 raise AbortFlashing(f"Did not receive response to {data} (expected {response})")
             self.state = new_state
@@ -285,13 +680,18 @@ class Flasher:
             # 4. State of the Flash         (4 bytes [10:14])
             # 5. The Response we want       (? bytes [14:])
             if response == res[14:]:
-                self.logger.debug(f"Received Response {response}")
+                self.logger.debug("Received Response %s", response)
                 return True
 
-    def do_file(self, file: io.BufferedReader, max_pos: int, file_name: str) -> None:
+    def do_file(self, file: io.BufferedReader, max_pos: int, file_name: str, digest: str = None) -> str:
         """
         Send one file to the Interface.
-        It sends multiple smaller Packets because of the `MAX_BYTES`
+        It sends multiple smaller Packets of `chunk_size` bytes, which is probed
+        with the first chunk of the first file
+
+        The SHA-256 of the sent bytes is computed while they are sent. If it
+        differs from `digest`, the flash is aborted before the device is told
+        that the file is complete, so a corrupted package is never installed.
 
         Arguments
         ---------
@@ -302,23 +702,50 @@ class Flasher:
             The length of the file to check when the whole file is sent
         file_name : str
             The name of the file to send (Would be used if the file_bar would be updated)
+        digest : str
+            The expected SHA-256 digest of the file as hex, not checked if None (default: None)
+
+        Returns
+        -------
+
+         - str: The SHA-256 digest of the sent bytes as hex
+
+        Raises
+        ------
+
+        AbortFlashing
+            The file ended before `max_pos` bytes or its digest differs from `digest`
         """
         file_pos = 0
+        sha256 = hashlib.sha256()
         next_log = 10 # output log message every 10% (for large files only)
+        started = time.monotonic()
+        pending = b"" # bytes of the first chunk that did not fit into the probed chunk size
+        chunks = self.pacer.chunks
+        if self.hooks:
+            self.emit(FileStart(self.info.mac, file_name, max_pos))
         while True:
-            self.state[1] += 1
-            data = file.read(self.MAX_BYTES)
-            self.write(data)
-            self.state[0] += 1
-            # Waiting for a response from interface to check that the interface received the Data
-            self.read() # should be b"RETR"
-
+            if self.chunk_size is None:
+                data = file.read(self.CHUNK_SIZES[0])
+                self.chunk_size = self.probe_chunk_size(data)
+                data, pending = data[:self.chunk_size], data[self.chunk_size:]
+            else:
+                data = file.read(self.chunk_size - len(pending))
+                if pending:
+                    data, pending = b"".join((pending, data)), b""
+                if not data and file_pos < max_pos:
+                    raise AbortFlashing(f"{file_name} ended after {file_pos} of {max_pos} bytes", "source")
+                self.send_chunk(data)
+
+            sha256.update(data)
             file_pos += len(data)
             file_percent = round(100*file_pos/(max_pos or 1))
             if file_percent >= next_log and max_pos > 100000: # 100kB
-                self.logger.info(f"    {file_name}: {file_percent}%")
+                self.logger.info("    %s: %d%%", file_name, file_percent)
                 next_log += 10
             if file_pos >= max_pos:
+                if digest is not None and sha256.hexdigest() != digest:
+                    raise AbortFlashing(f"{file_name} has the SHA-256 digest {sha256.hexdigest()}, expected {digest}", "digest")
                 res, new_state = self.read()
                 if res is None:
                     raise AbortFlashing(f"Did not receive response to file upload (state {self.state})")
@@ -332,31 +759,152 @@ class Flasher:
                 if b"RETR" == res[14:]:
                     # Close the file when the installation is done
                     file.close()
-                    return True
+                    elapsed = time.monotonic() - started
+                    if self.metrics:
+                        self.metrics.inc("pynetinstall_bytes_sent_total", file_pos)
+                        self.metrics.inc("pynetinstall_chunks_sent_total", self.pacer.chunks - chunks)
+                    if self.hooks:
+                        self.emit(FileEnd(self.info.mac, file_name, max_pos, file_pos, self.pacer.chunks - chunks, elapsed,
+                                          sha256.hexdigest()))
+                    self.logger.debug("Uploaded %s in %.1fs (%.0f kB/s, delay %.2fms, %d state errors)", file_name, elapsed,
+                                      file_pos / (elapsed or 1) / 1000, self.pacer.delay * 1000, self.pacer.errors)
+                    return sha256.hexdigest()
                 else:
                     raise Exception("File was not received properly")
             else:
-                # main reason why flashing is so slow but without this sleep state errors occur
-                time.sleep(0.005)
+                # without a delay between the chunks state errors occur, the pacer adapts it to how fast the device keeps up
+                self.pacer.wait()
+
+    def send_chunk(self, data: bytes, timeout: float = None, retransmit: bool = True) -> bytes or None:
+        """
+        Send one chunk of a file and wait until the device acknowledges it
+
+        Arguments
+        ---------
+
+        data : bytes
+            The chunk to send
+        timeout : float
+            Time in seconds to wait for the acknowledgement (default: the timeout of the connection)
+        retransmit : bool
+            Whether the chunk is sent again if the acknowledgement is late, see read() (default: True)
+
+        Returns
+        -------
+
+         - bytes: The acknowledgement of the device, or None on a state error
+        """
+        errors = self.conn.discarded["state"]
+        self.send(data)
+        # Waiting for a response from interface to check that the interface received the Data
+        res, _ = self.read(timeout, retransmit) # should be b"RETR"
+        rtt = time.monotonic() - self.sent_at
+        # late and lost acknowledgements slow the pacer down like state errors
+        self.pacer.record(len(data), rtt, self.conn.discarded["state"] - errors + self.retransmits + (res is None))
+        if self.metrics and res is not None and not self.retransmits:
+            self.metrics.observe("pynetinstall_ack_rtt_seconds", rtt)
+        if self.hooks and res is not None:
+            self.emit(ChunkAcked(self.info.mac, len(data), rtt, self.retransmits))
+        return res
+
+    def probe_chunk_size(self, data: bytes) -> int:
+        """
+        Send the first chunk of an upload with the largest of the `CHUNK_SIZES`
+        the device acknowledges.
+
+        Larger chunks mean fewer round trips per file, but not every boot image
+        accepts them. A chunk that is not acknowledged even after its
+        retransmissions (see probe_chunk()) was dropped for its size, the next
+        smaller size is sent with a new state. A state is never sent again with
+        another payload: a device that stored the chunk but whose acknowledgement
+        was lost would only repeat the acknowledgement and the rest of the chunk
+        would be sent twice. If the device answers with an unexpected state
+        after a fallback, it is unknown how many bytes it received and the flash
+        is aborted. The accepted size is remembered for the model and
+        architecture of the device, so the probe only runs once per model.
+
+        Arguments
+        ---------
+
+        data : bytes
+            The first bytes of the file, at least `CHUNK_SIZES[0]` bytes unless the file is smaller
+
+        Returns
+        -------
+
+         - int: The accepted chunk size, the bytes of `data` after it still have to be sent
+        """
+        key = (self.info.model, self.info.arch)
+        if key in self.accepted_chunk_sizes:
+            size = self.accepted_chunk_sizes[key]
+            self.send_chunk(data[:size])
+            return size
+
+        errors = None
+        for size in self.CHUNK_SIZES:
+            if self.probe_chunk(data[:size]):
+                break
+            self.logger.debug("Chunks of %d bytes are not acknowledged by %s (%s)", size, self.info.model, self.info.arch)
+            if errors is None:
+                errors = self.conn.discarded["state"]
+        else:
+            raise AbortFlashing("Device did not acknowledge the first chunk of the upload", "timeout")
+        if errors is not None and self.conn.discarded["state"] != errors:
+            # e.g. the late acknowledgement of a larger chunk, the device may have stored both
+            raise AbortFlashing("Device answered with an unexpected state while probing the chunk size, "
+                                "the number of bytes it received is unknown")
+
+        if len(data) >= size: # a shorter first chunk does not prove that the size is accepted
+            self.logger.debug("Sending chunks of %d bytes to %s (%s)", size, self.info.model, self.info.arch)
+            self.accepted_chunk_sizes[key] = size
+        return size
+
+    def probe_chunk(self, data: bytes) -> bool:
+        """
+        Send the chunk of probe_chunk_size() with a new state and wait
+        `PROBE_TIMEOUT` seconds for the acknowledgement, up to `PROBE_RETRANSMITS`
+        more times with the same state and payload. A device that stored the
+        chunk repeats its acknowledgement for a retransmission, so only a
+        device that drops the chunk stays silent.
+
+        Returns
+        -------
+
+         - bool: Whether the device acknowledged the chunk
+        """
+        for attempt in range(self.PROBE_RETRANSMITS + 1):
+            try:
+                if not attempt:
+                    if self.send_chunk(data, self.PROBE_TIMEOUT, retransmit=False) is not None:
+                        return True
+                    continue
+                self.retransmit()
+                res, _ = self.read(self.PROBE_TIMEOUT, retransmit=False)
+                if res is not None:
+                    return True
+            except AbortFlashing:
+                pass
+        return False
 
     def do_files(self) -> None:
         """
         Sends the npk and the rsc file to the Connection using the do_files() Function
         It requests both files from the get_files() Function of the Plugin
         """
-        *npks, rsc = self.plugin.get_files(self.info)
+        *npks, rsc = self.get_files(self.info)
         if not all(npks):
-            raise AbortFlashing("Plugin did not return RouterOS or an additional package is 'None'.")
-        for npk in npks:
+            raise AbortFlashing("Plugin did not return RouterOS or an additional package is 'None'.", "plugin")
+        self.wait_prefetch()
+        for index, npk in enumerate(npks):
             # Send the .npk file
-            npk_file, npk_file_name, npk_file_size = self.resolve_file_data(npk)
+            npk_file, npk_file_name, npk_file_size = self.open_file(index)
             try:
                 self.do(bytes(f"FILE\n{npk_file_name}\n{str(npk_file_size)}\n", "utf-8"), b"RETR")
             except AbortFlashing:
                 # NOTE: it appears that not all devices send a 'RETR' response here, so we ignore it.
                 pass
-            self.logger.info(f"Uploading {npk_file_name}")
-            self.do_file(npk_file, npk_file_size, npk_file_name)
+            self.logger.info("Uploading %s", npk_file_name)
+            self.upload(npk_file, npk_file_size, npk_file_name, index)
 
             # wait before sending the next file
             self.do(b"", b"RETR")
@@ -365,15 +913,186 @@ class Flasher:
 
         # Send the initial config file. routerOS expects filename to be autorun.scr.
         if rsc:
-            rsc_file, rsc_file_name, rsc_file_size = self.resolve_file_data(rsc)
+            rsc_file, rsc_file_name, rsc_file_size = self.open_file(len(npks))
             self.do(bytes(f"FILE\nautorun.scr\n{str(rsc_file_size)}\n", "utf-8"), b"RETR")
-            self.logger.info(f"Uploading {rsc_file_name}")
-            self.do_file(rsc_file, rsc_file_size, rsc_file_name)
+            self.logger.info("Uploading %s", rsc_file_name)
+            self.upload(rsc_file, rsc_file_size, rsc_file_name, len(npks))
 
             self.do(b"", b"RETR")
             self.logger.debug("Done with the Configuration File")
 
-    def resolve_file_data(self, data) -> tuple[BufferedReader or HTTPResponse, str, int]:
+    def upload(self, file: ReadAhead, size: int, name: str, index: int = None) -> None:
+        """
+        Send a file opened by open_file() with do_file(), checking the digest
+        of expect_digest() for the file at `index` of get_files(). The digest
+        of an uploaded local file is remembered in the `digests`.
+        """
+        try:
+            digest = self.do_file(file, size, name, self.expected.get(index))
+        finally:
+            file.close()
+        if self.digests is not None and self.digest_keys.get(index):
+            self.digests.set(self.digest_keys[index], digest)
+        self.logger.debug("%s: waited %d times (%.3fs) for the source", name, file.waits, file.wait_time)
+
+    def get_files(self, info: InterfaceInfo) -> tuple:
+        """
+        Get the files for the device from the `plugin`, only asking it once per flash.
+        The first call starts the flash for the `metrics`.
+
+        Returns
+        -------
+
+         - tuple: The .npk files and the .rsc file (or None) as returned by the `plugin`
+
+        Raises
+        ------
+
+        AbortFlashing
+            The `plugin` raised an error
+        """
+        if self.files is None:
+            if self.metrics:
+                self.metrics.inc("pynetinstall_flashes_started_total")
+            try:
+                self.files = tuple(self.plugin.get_files(info))
+            except (AbortFlashing, FatalError):
+                raise
+            except Exception as e:
+                raise AbortFlashing(f"Plugin failed: {e} ({type(e).__name__})", "plugin") from e
+        return self.files
+
+    def open_file(self, index: int, spool: bool = False) -> tuple[ReadAhead, str, int]:
+        """
+        Resolve the file at `index` of get_files() and read up to `READ_AHEAD`
+        bytes ahead in the background. Each file is resolved once per flash,
+        so verify_npk() and do_files() share the same stream.
+
+        Arguments
+        ---------
+
+        index : int
+            The index of the file in get_files()
+        spool : bool
+            Download a remote file completely in the background, the bytes
+            beyond `READ_AHEAD` are written to a temporary file (default: False)
+
+        Returns
+        -------
+
+         - ReadAhead: The file
+         - str: The name of the file
+         - int: The size of the file
+        """
+        if index not in self.opened:
+            file, name, size = self.resolve_file_data(self.files[index])
+            # local files are read as fast as they are uploaded, spooling would only copy them
+            spool = spool and not is_regular_file(file)
+            self.opened[index] = (ReadAhead(file, self.READ_AHEAD, spool=spool), name, size)
+            self.expect_digest(index)
+        return self.opened[index]
+
+    def expect_digest(self, index: int) -> None:
+        """
+        Look up the SHA-256 digest the file at `index` of get_files() must
+        have, do_file() aborts the flash if the uploaded bytes differ. Taken from
+         1. the get_digest(file) function of the `plugin`, if it has one
+         2. a `<file>.sha256` file next to a local file, as written by sha256sum
+         3. the `digests` of a previous upload of the unchanged local file
+         4. the `cache` for a downloaded URL
+        """
+        data = self.files[index]
+        get_digest = getattr(self.plugin, "get_digest", None)
+        digest = get_digest(data) if get_digest is not None else None
+        if isinstance(data, str) and "://" not in data:
+            key = self.digests.key(data) if self.digests is not None else None
+            self.digest_keys[index] = key
+            digest = digest or read_sidecar(data) or (key and self.digests.get(key))
+        elif self.cache and isinstance(data, str):
+            digest = digest or self.cache.digest(data)
+        self.expected[index] = digest.lower() if digest else None
+
+    def prefetch(self) -> None:
+        """
+        Resolve the files of get_files() that are not opened yet in a
+        background thread, which also starts reading them ahead. Called once
+        the device is verified, so lookups and downloads happen while the
+        device formats and the upload starts as soon as it is ready.
+
+        Up to `PREFETCH_WORKERS` files are resolved at the same time, remote
+        files are downloaded completely (spooled, see open_file()), so the
+        next packages are local while the previous one is uploaded.
+        """
+        indices = [index for index, data in enumerate(self.files or ()) if data is not None and index not in self.opened]
+        if indices and self.prefetcher is None:
+            self.prefetcher = threading.Thread(target=self._prefetch, args=(indices,), daemon=True,
+                                               name=f"prefetch-{self.info.mac.hex(':')}")
+            self.prefetcher.start()
+
+    def _prefetch(self, indices: list[int]) -> None:
+        """
+        Open the files at `indices` for prefetch(), keeping the first error for wait_prefetch()
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(min(self.PREFETCH_WORKERS, len(indices)), f"{threading.current_thread().name}-") as workers:
+                for _ in workers.map(lambda index: self.open_file(index, spool=True), indices):
+                    pass
+        except Exception as e:
+            self.prefetch_error = e
+            return
+        self.logger.debug("Resolved %d files in the background in %.3fs", len(indices), time.monotonic() - started)
+
+    def wait_prefetch(self) -> None:
+        """
+        Wait until the files of prefetch() are resolved
+
+        Raises
+        ------
+
+        AbortFlashing
+            A file could not be resolved (or any other error of resolve_file_data())
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.join()
+            self.prefetcher = None
+        if self.prefetch_error is not None:
+            error, self.prefetch_error = self.prefetch_error, None
+            raise error
+
+    def close_files(self) -> None:
+        """
+        Close all files opened by open_file() and prefetch()
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.join()
+            self.prefetcher = None
+        self.prefetch_error = None
+        for file, _, _ in self.opened.values():
+            file.close()
+        self.opened = {}
+
+    def map_files(self, store: MappedStore, info: InterfaceInfo = None) -> None:
+        """
+        Resolve all files of get_files() and map them into memory with the
+        `store`, so open_file() returns them without resolving them again.
+        Used before the flash is handed to a worker process.
+
+        With `info`, the header of the RouterOS file is checked for the device
+        (check_npk_header()) before it is copied and before the other files
+        are resolved. Files from URLs are staged once by the `store` for all
+        flashes starting at about the same time.
+        """
+        for index, data in enumerate(self.files):
+            if data is not None and index not in self.opened:
+                check = (lambda header: self.check_npk_header(header, info)) if index == 0 and info is not None else None
+                key = data if isinstance(data, str) and "://" in data else None
+                self.opened[index] = store.stage(key, lambda: self.resolve_file_data(data), check)
+                self.expect_digest(index)
+
+    def resolve_file_data(self, data) -> tuple[BufferedReader or PooledResponse, str, int]:
         """
         This function resolves some data from a file
 
@@ -386,7 +1105,7 @@ class Flasher:
         Returns
         -------
 
-         - BufferedReader or HTTPResponse: object with a .read() function 
+         - BufferedReader or PooledResponse: object with a .read() function 
          - str: The name of the file
          - int: The size of the file
 
@@ -403,18 +1122,22 @@ class Flasher:
             name = basename(data.name)
             file = data
             self.logger.debug("Resolved File-Data from the BufferedReader")
+        elif self.cache and isinstance(data, str) and data.lower().startswith(("http://", "https://")):
+            # data is a url to a file, served from the cache
+            try:
+                file, name, size = self.cache.open(data)
+                self.logger.debug("Resolved File-Data from the URL (cached)")
+            except Exception as e:
+                raise AbortFlashing(f"Unable to download {data}: {e}", "network")
         else:
             # data is a url to a file
             try:
                 # Working
-                file = request.urlopen(data)
+                if not (isinstance(data, str) and "://" in data):
+                    raise ValueError(f"{data!r} is not a URL")
+                file = self.http.get(data)
                 size = int(file.getheader("Content-Length"))
-                try: # use server provided file name if available
-                    name = file.getheader("Content-Disposition")
-                    name = name.split("=")[1]
-                except: # extract basename from URL
-                    _, _, name = data.rpartition('/')
-                    name, _, _ = name.partition('?')
+                name = url_file_name(file.url, file)
                 self.logger.debug("Resolved File-Data from the URL")
             except:
                 # data is a filename/path
@@ -425,7 +1148,7 @@ class Flasher:
                     file = open(data, "rb")
                     self.logger.debug("Resolved File-Data from the Path/Filename")
                 except:
-                    raise AbortFlashing(f"Unable to read file/url/BufferedReader ({data})")
+                    raise AbortFlashing(f"Unable to read file/url/BufferedReader ({data})", "source")
         return file, name, size
 
 class FlashInterface:
@@ -435,12 +1158,30 @@ class FlashInterface:
     Attributes
     ----------
 
+    connections : list[UDPConnection]
+        The Connections to wait for new Interfaces, one per network interface
     connection : UDPConnection
-        The Connection to wait for new Interfaces
+        The first of the `connections`, used by flash_once() and flash_until_stopped()
     config_file : str
         The location of the configuration file (default: config.ini)
     logger : Logger
         The Logger to log LogRecords
+    cache : FirmwareCache
+        The cache shared by all flashes for files served over HTTP(S), or None
+    http : HTTPPool
+        The connections to HTTP(S) servers shared by all flashes and the `cache`
+    digests : DigestCache
+        The digests of the uploaded local files, kept in the `cache_dir` if it is set
+    plugins : PluginLoader
+        Loads the Plugin from the `config_file` once and again whenever the file changes
+    plugin : Plugin
+        The current Plugin of the `plugins`, shared by all flashes
+    metrics : Metrics
+        The counters and histograms of all flashes, served over HTTP, or None
+    hooks : list[callable]
+        Functions called with the events of all flashes, see `Flasher.hooks`
+    read_ahead : int
+        How many bytes of a file each flash reads ahead while uploading, see `Flasher.READ_AHEAD`
 
     Methods
     -------
@@ -450,41 +1191,119 @@ class FlashInterface:
 
     flash_until_stopped() -> None
         Run flash until someone stops the program
+
+    flash_concurrently(max_devices, processes=False) -> None
+        Flash up to `max_devices` devices at the same time on all `connections` until someone stops the program
     """
-    def __init__(self, interface_name : str = None, mac_address : str = None, config_file : str = "config.ini", log_level: int = logging.INFO) -> None:
+    def __init__(self, interface_name : str or list[str] = None, mac_address : str or list[str] = None, config_file : str = "config.ini", log_level: int = logging.INFO,
+                 device_address: tuple = None, cache_dir: str = None, cache_size: int = 1024 ** 3,
+                 kernel_filter: bool = False, transport: str = "udp", metrics_address: tuple = None, trace_file: str = None,
+                 read_ahead: int = Flasher.READ_AHEAD) -> None:
         """
         Initialize a new FlashInterface
 
         Create a new Logger instance and a new `connection` to wait for new
         Interfaces. One of `interface_name` or `mac_address` must be provided.
+        Several interfaces can be given, each gets its own connection bound to
+        the interface (Linux only).
 
         Argument
         --------
 
-        interface_name : str
-            The name of the interface to listen on
+        interface_name : str or list[str]
+            The name of the interface(s) to listen on
 
-        mac_address : str|bytes
-            The mac address of the interface to listen on
+        mac_address : str|bytes or list[str|bytes]
+            The mac address of the interface(s) to listen on
 
         log_level : int
             What level should be logged by the `logger`
+
+        device_address : tuple
+            Address Pair to talk to instead of broadcasting, e.g. `pynetinstall.emulator`
+
+        cache_dir : str
+            Where to cache files served over HTTP(S) and the digests of local files, None to disable the cache
+
+        cache_size : int
+            How many bytes the cached files may use (default: 1 GB)
+
+        kernel_filter : bool
+            Let the kernel drop packets that are not sent by a device (Linux only)
+
+        transport : str
+            "udp" to broadcast UDP packets, "l2" to send raw ethernet frames to
+            the MAC Address of each device (Linux only, needs CAP_NET_RAW)
+
+        metrics_address : tuple
+            Address Pair to serve the `metrics` on in the Prometheus text format, None to disable them
+
+        trace_file : str
+            Append the events of all flashes to this file as JSON lines, None to disable the trace
+
+        read_ahead : int
+            How many bytes of a file each flash reads ahead while uploading, 0 to disable (default: 512 kB)
         """
         self.logger = Logger(log_level)
         self.config_file = config_file
-        try:
-            self.connection = UDPConnection(logger=self.logger, interface_name=interface_name, mac_address=mac_address)
-        except (OSError, ValueError) as e:
-            raise FatalError(f"{e} ({interface_name or mac_address})")
+        self.read_ahead = read_ahead
+        self.plugins = PluginLoader(config_file, self.logger)
+        self.http = HTTPPool(logger=self.logger)
+        self.cache = None
+        if cache_dir:
+            try:
+                self.cache = FirmwareCache(cache_dir, cache_size, logger=self.logger, http=self.http)
+            except OSError as e:
+                raise FatalError(f"Could not create the cache: {e}")
+        self.digests = DigestCache(os.path.join(cache_dir, "digests.json") if cache_dir else None)
+        names = [interface_name] if isinstance(interface_name, str) else list(interface_name or [])
+        macs = [mac_address] if isinstance(mac_address, (str, bytes)) else list(mac_address or [])
+        interfaces = [{"interface_name": name} for name in names] + [{"mac_address": mac} for mac in macs]
+        self.connections = []
+        for interface in interfaces or [{}]:
+            try:
+                if transport == "l2":
+                    connection = L2Connection(logger=self.logger, device_addr=device_address, **interface)
+                else:
+                    connection = UDPConnection(logger=self.logger, device_addr=device_address, kernel_filter=kernel_filter,
+                                               bind_interface=len(interfaces) > 1, **interface)
+            except (OSError, ValueError) as e:
+                for connection in self.connections:
+                    connection.close()
+                raise FatalError(f"{e} ({', '.join(map(str, interface.values()))})")
+            self.connections.append(connection)
+        self.connection = self.connections[0]
+
+        self.hooks = []
+        if trace_file:
+            try:
+                self.hooks.append(JSONLinesSink(trace_file))
+            except OSError as e:
+                raise FatalError(f"Could not open the trace file: {e}")
+
+        self.metrics = None
+        if metrics_address:
+            self.metrics = Metrics(self.logger)
+            self.metrics.collect(self._discarded)
+            self.metrics.collect(self._plugin_cache)
+            try:
+                self.metrics.serve(metrics_address[1], metrics_address[0])
+            except OSError as e:
+                raise FatalError(f"Could not serve the metrics on {metrics_address[0]}:{metrics_address[1]}: {e}")
 
     def flash_once(self) -> None:
         """
         Flash one Interface
         """
-        flash = Flasher(self.connection, config_file=self.config_file, logger=self.logger)
+        flash = self._new_flasher(self.connection)
         interface = self.connection.get_interface_info()
-        flash.verify_npk(interface)
-        flash.run(interface)
+        self._discovered(flash, interface, self.connection)
+        flash.plugin = self.plugins.acquire()
+        try:
+            flash.verify_npk(interface)
+            flash.run(interface)
+        finally:
+            self.plugins.release(flash.plugin)
         self.connection.close()
 
     def flash_until_stopped(self) -> None:
@@ -494,16 +1313,234 @@ class FlashInterface:
         try:
             while True:
                 try:
-                    flash = Flasher(self.connection, config_file=self.config_file, logger=self.logger)
-                    self.logger.info(f"Waiting for devices...")
+                    flash = self._new_flasher(self.connection)
+                    self.logger.info("Waiting for devices...")
                     interface = None
                     while not interface:
                         interface = self.connection.get_interface_info()
-                    self.logger.info(f"Device found! mac={interface.mac.hex(':')}, model={interface.model}, arch={interface.arch}")
-                    flash.verify_npk(interface)
-                    flash.run(interface)
+                    self._discovered(flash, interface, self.connection)
+                    flash.plugin = self.plugins.acquire()
+                    try:
+                        flash.verify_npk(interface)
+                        flash.run(interface)
+                    finally:
+                        self.plugins.release(flash.plugin)
+                        self.connection.forget(interface.mac)
                 except AbortFlashing as e:
                     self.logger.error(f"Flashing failed: {e}")
                     continue
         finally:
             self.connection.close()
+
+    def flash_concurrently(self, max_devices: int = 4, processes: bool = False) -> None:
+        """
+        Flash until someone stops the program, running up to `max_devices`
+        flashes at the same time.
+
+        A `Dispatcher` reads the packets from all `connections` and passes
+        them to the `Flasher` of the device that sent them, each of which runs
+        in its own thread. Devices announcing themselves while `max_devices`
+        flashes are running are ignored until a slot becomes available. All
+        flashes share the `plugin` and the `cache`.
+
+        With `processes`, each flash runs in a forked worker process instead,
+        so framing and syscalls of several devices use several cores. The
+        files are resolved, verified and mapped into memory (`MappedStore`)
+        by a staging thread before the fork, all workers read the same pages. The workers write to the
+        inherited sockets, the Dispatcher passes them the packets of their
+        device through a pipe.
+
+        Arguments
+        ---------
+
+        max_devices : int
+            How many devices are flashed at the same time (default: 4)
+        processes : bool
+            Flash each device in a worker process (Linux only, default: False)
+        """
+        dispatcher = Dispatcher(self.connections, self.logger)
+        if processes:
+            import multiprocessing
+        context = multiprocessing.get_context("fork") if processes else None
+        store = MappedStore() if processes else None
+        active: dict[bytes, threading.Thread or multiprocessing.Process] = {}
+        results: dict[bytes, multiprocessing.connection.Connection] = {}
+        # the flashes whose files are mapped by a staging thread, and those that are ready for a worker
+        staging: dict[bytes, tuple[Flasher, InterfaceInfo, PipeQueue]] = {}
+        staged: set[bytes] = set()
+        try:
+            self.logger.info("Waiting for devices...")
+            while True:
+                for interface, connection in dispatcher.poll(1):
+                    if interface.mac in active or len(active) >= max_devices:
+                        continue
+                    name = f"flash-{interface.mac.hex(':')}"
+                    if not processes:
+                        flash = self._new_flasher(dispatcher.open(interface.mac, connection))
+                        self._discovered(flash, interface, connection)
+                        active[interface.mac] = threading.Thread(target=self._flash_thread, args=(flash, interface), name=name, daemon=True)
+                        active[interface.mac].start()
+                        continue
+
+                    packets = PipeQueue(context)
+                    flash = self._new_flasher(dispatcher.open(interface.mac, connection, packets))
+                    self._discovered(flash, interface, connection)
+                    # downloads would stop the dispatcher from passing packets to the running workers
+                    staging[interface.mac] = (flash, interface, packets)
+                    active[interface.mac] = threading.Thread(target=self._stage, args=(flash, interface, store, staged),
+                                                             name=f"stage-{interface.mac.hex(':')}", daemon=True)
+                    active[interface.mac].start()
+                for mac, worker in list(active.items()):
+                    if worker.is_alive():
+                        continue
+                    if mac in staging:
+                        flash, interface, packets = staging.pop(mac)
+                        # the worker process has its own copy of the Plugin
+                        self.plugins.release(flash.plugin)
+                        if mac in staged:
+                            staged.discard(mac)
+                            # the worker sends the snapshot of its metrics back when it is done
+                            results[mac], results_writer = context.Pipe(duplex=False)
+                            active[mac] = context.Process(target=self._flash_worker, args=(flash, interface, results_writer),
+                                                          name=f"flash-{mac.hex(':')}", daemon=True)
+                            active[mac].start()
+                            packets.reader.close()
+                            results_writer.close()
+                            continue
+                    if mac in results:
+                        self._merge_results(results.pop(mac))
+                    dispatcher.close(mac)
+                    del active[mac]
+        finally:
+            dispatcher.shutdown()
+            for connection in self.connections:
+                connection.close()
+
+    @property
+    def plugin(self) -> Plugin:
+        """
+        The current Plugin, see PluginLoader
+        """
+        return self.plugins.plugin
+
+    def _new_flasher(self, connection) -> Flasher:
+        """
+        Create the Flasher for one flash over `connection`, sharing the
+        `plugin`, `cache`, `http` pool, `digests`, `metrics` and `hooks` with all other flashes
+        """
+        return Flasher(connection, config_file=self.config_file, logger=self.logger, cache=self.cache,
+                       plugin=self.plugin, metrics=self.metrics, hooks=self.hooks, http=self.http, digests=self.digests,
+                       read_ahead=self.read_ahead)
+
+    def _discovered(self, flash: Flasher, interface: InterfaceInfo, connection: UDPConnection) -> None:
+        """
+        Log a device that is going to be flashed and pass the event to the `hooks`
+        """
+        self.logger.info("Device found! mac=%s, model=%s, arch=%s%s", interface.mac.hex(':'), interface.model, interface.arch,
+                         f", interface={connection.interface_name}" if len(self.connections) > 1 else "")
+        if self.hooks:
+            flash.emit(DeviceDiscovered(interface.mac, interface.model, interface.arch, connection.interface_name))
+
+    def _stage(self, flash: Flasher, interface: InterfaceInfo, store: MappedStore, staged: set) -> None:
+        """
+        Resolve, verify and map the files of a flash before it is handed to a
+        worker process, used by flash_concurrently(). Adds the MAC Address
+        of the device to `staged` once the files are mapped. The Plugin is
+        acquired here and released by flash_concurrently().
+        """
+        flash.plugin = self.plugins.acquire()
+        try:
+            flash.get_files(interface)
+            flash.map_files(store, interface)
+        except Exception as e:
+            flash.close_files()
+            self.logger.error(f"Flashing {interface.mac.hex(':')} failed: {e}"
+                              + ("" if isinstance(e, (AbortFlashing, FatalError)) else f" ({type(e).__name__})"))
+            if self.metrics:
+                self.metrics.inc("pynetinstall_flashes_aborted_total", phase="verify", reason=abort_reason(e))
+            if self.hooks:
+                flash.emit(Aborted(interface.mac, "verify", str(e)))
+            return
+        staged.add(interface.mac)
+
+    def _flash_thread(self, flash: Flasher, interface: InterfaceInfo) -> None:
+        """
+        Flash one device in a thread with the current Plugin, used by flash_concurrently()
+        """
+        flash.plugin = self.plugins.acquire()
+        try:
+            self._flash_device(flash, interface)
+        finally:
+            self.plugins.release(flash.plugin)
+
+    def _flash_worker(self, flash: Flasher, interface: InterfaceInfo, results) -> None:
+        """
+        Flash one device in a worker process, used by flash_concurrently()
+
+        The worker records into its own `metrics` and sends their snapshot
+        to the parent through `results` when it is done, together with the
+        `accepted_chunk_sizes`, so the workers forked later do not probe the
+        chunk size of the model again.
+        """
+        # the parent handles Ctrl+C and terminates the workers
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if self.metrics:
+            self.metrics = flash.metrics = Metrics()
+        try:
+            self._flash_device(flash, interface)
+            results.send({"metrics": self.metrics.snapshot() if self.metrics else None,
+                          "chunk_sizes": dict(Flasher.accepted_chunk_sizes)})
+            results.close()
+        finally:
+            # the process exits without running atexit, write the queued log records now
+            stop_queue()
+
+    def _merge_results(self, results) -> None:
+        """
+        Merge the metrics and the accepted chunk sizes a worker process sent
+        through `results`, see _flash_worker()
+        """
+        try:
+            if results.poll():
+                received = results.recv()
+                Flasher.accepted_chunk_sizes.update(received["chunk_sizes"])
+                if self.metrics and received["metrics"]:
+                    self.metrics.merge(received["metrics"])
+        except (EOFError, OSError):
+            pass
+        results.close()
+
+    def _discarded(self) -> list[tuple[str, dict, int]]:
+        """
+        The packets discarded by the `connections`, rendered by the `metrics`
+        """
+        return [("pynetinstall_packets_discarded_total", {"reason": reason}, count)
+                for connection in self.connections for reason, count in connection.discarded.items()]
+
+    def _plugin_cache(self) -> list[tuple[str, dict, int]]:
+        """
+        The hits and misses of the `plugin` cache, rendered by the `metrics`
+        """
+        plugin = self.plugins.plugin
+        if not isinstance(plugin, CachedPlugin):
+            return []
+        stats = plugin.stats()
+        return [("pynetinstall_plugin_cache_hits_total", {}, stats["hits"]),
+                ("pynetinstall_plugin_cache_misses_total", {}, stats["misses"])]
+
+    def _flash_device(self, flash: Flasher, interface: InterfaceInfo) -> None:
+        """
+        Flash one device with its `flash`, used by flash_concurrently()
+        """
+        try:
+            flash.verify_npk(interface)
+            flash.run(interface)
+        except (AbortFlashing, FatalError) as e:
+            self.logger.error(f"Flashing {interface.mac.hex(':')} failed: {e}")
+        except Exception as e:
+            self.logger.error(f"Flashing {interface.mac.hex(':')} failed: {e} ({type(e).__name__})")
+        finally:
+            # the packets of the device skipped by its channel, the others are counted by the connections
+            if self.metrics:
+                for reason, count in flash.conn.discarded.items():
+                    self.metrics.inc("pynetinstall_packets_discarded_total", count, reason=reason)
@@ -0,0 +1,286 @@
+import os
+import time
+import weakref
+import threading
+import collections
+
+from pynetinstall.log import Logger
+
+
+class PooledResponse:
+    """
+    The response to a request of `HTTPPool`
+
+    The connection goes back to the pool once the body is read completely
+    and the response is closed. A response closed before its end closes the
+    connection, the rest of the body can not be skipped cheaply.
+
+    Attributes
+    ----------
+
+    url : str
+        The URL of the response, after redirects
+    status : int
+        The HTTP status code
+    reason : str
+        The HTTP reason phrase
+    headers : http.client.HTTPMessage
+        The headers of the response
+
+    Methods
+    -------
+
+    read(size=-1) -> bytes
+        Read `size` bytes of the body, or everything until its end
+
+    getheader(name, default=None) -> str
+        The value of the header `name`
+
+    close() -> None
+        Return the connection to the pool or close it
+    """
+    def __init__(self, pool: "HTTPPool", key: tuple, connection, response, url: str) -> None:
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Read `size` bytes of the body, fewer only at its end
+        """
+        data = self.response.read(None if size < 0 else size)
+        if self.response.isclosed():
+            self.close()
+        return data
+
+    def getheader(self, name: str, default: str = None) -> str:
+        """
+        The value of the header `name`, `default` if the response does not have it
+        """
+        return self.response.getheader(name, default)
+
+    def close(self) -> None:
+        """
+        Return the connection to the pool if the body was read completely, close it otherwise
+        """
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.release(self.key, connection)
+        else:
+            self.response.close()
+            connection.close()
+
+    def __enter__(self) -> "PooledResponse":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class HTTPPool:
+    """
+    Keeps connections to HTTP(S) servers open (keep-alive) and reuses them
+    for the next request to the same host, so the files of every device do
+    not pay a new TCP and TLS handshake each.
+
+    Connections are only kept while they are idle: at most `max_idle` per
+    host and for `idle_timeout` seconds. The number of connections in use is
+    not limited, a flash reads several files at the same time.
+
+    URLs with other schemes, and all URLs when a proxy is configured in the
+    environment (http_proxy, https_proxy), are opened with urllib instead.
+
+    Attributes
+    ----------
+
+    max_idle : int
+        How many idle connections are kept per host (default: 4)
+    idle_timeout : float
+        How many seconds an idle connection is kept (default: 60)
+    timeout : float
+        The socket timeout of the connections in seconds (default: 60)
+    opened : int
+        How many connections were opened
+    reused : int
+        How many requests were sent over an idle connection of the pool
+
+    Methods
+    -------
+
+    get(url, headers=None) -> PooledResponse
+        Send a GET request
+
+    release(key, connection) -> None
+        Return an idle connection to the pool
+
+    clear() -> None
+        Close all idle connections
+    """
+    MAX_REDIRECTS: int = 5
+
+    def __init__(self, max_idle: int = 4, idle_timeout: float = 60, timeout: float = 60, logger: Logger = None) -> None:
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.logger = logger
+        self.opened = 0
+        self.reused = 0
+        self.idle: dict[tuple, collections.deque] = {}
+        self.lock = threading.Lock()
+        _pools.add(self)
+
+    def get(self, url: str, headers: dict = None) -> PooledResponse:
+        """
+        Send a GET request for `url`, following redirects
+
+        Raises
+        ------
+
+        urllib.error.HTTPError
+            The server answered with a status other than 2xx (e.g. 304 Not Modified)
+        urllib.error.URLError
+            The server can not be reached
+        """
+        return self.request("GET", url, headers)
+
+    def request(self, method: str, url: str, headers: dict = None) -> PooledResponse:
+        """
+        Send a request for `url`, following redirects, see get()
+        """
+        # imported on the first request, http.client pulls in ssl and email
+        from http.client import HTTPException
+        from urllib.error import HTTPError, URLError
+        from urllib.parse import urlsplit, urljoin
+
+        if urlsplit(url).scheme.lower() not in ("http", "https") or _proxied():
+            from urllib import request
+            return request.urlopen(request.Request(url, headers=headers or {}, method=method))
+
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            scheme = parts.scheme.lower()
+            key = (scheme, parts.hostname, parts.port or (443 if scheme == "https" else 80))
+            path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+            try:
+                response = self._send(key, method, path, headers or {}, url)
+            except (OSError, HTTPException) as e:
+                raise URLError(e)
+            location = response.getheader("Location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                response.read()
+                response.close()
+                url = urljoin(url, location)
+                if response.status == 303:
+                    method = "GET"
+                continue
+            if not 200 <= response.status < 300:
+                response.read()
+                response.close()
+                raise HTTPError(url, response.status, response.reason, response.headers, None)
+            return response
+        raise URLError(f"too many redirects ({url})")
+
+    def _send(self, key: tuple, method: str, path: str, headers: dict, url: str) -> PooledResponse:
+        """
+        Send a request over an idle connection to the host of `key`, or a new
+        one if there is none or the server closed the idle connection
+        """
+        from http.client import BadStatusLine
+
+        while True:
+            connection, reused = self._acquire(key)
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+            except (ConnectionError, BadStatusLine):
+                connection.close()
+                if reused:
+                    # the server closed the idle connection, try the next one
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            return PooledResponse(self, key, connection, response, url)
+
+    def _acquire(self, key: tuple) -> tuple:
+        """
+        The most recently used idle connection to the host of `key`, or a new
+        connection if there is none
+
+        Returns
+        -------
+
+         - http.client.HTTPConnection: The connection
+         - bool: Whether the connection was idle in the pool
+        """
+        now = time.monotonic()
+        with self.lock:
+            idle = self.idle.get(key)
+            while idle:
+                connection, since = idle.pop()
+                if now - since < self.idle_timeout:
+                    self.reused += 1
+                    return connection, True
+                connection.close()
+
+        from http.client import HTTPConnection, HTTPSConnection
+
+        scheme, host, port = key
+        connection = (HTTPSConnection if scheme == "https" else HTTPConnection)(host, port, timeout=self.timeout)
+        with self.lock:
+            self.opened += 1
+        if self.logger:
+            self.logger.debug("Opening a connection to %s://%s:%d", scheme, host, port)
+        return connection, False
+
+    def release(self, key: tuple, connection) -> None:
+        """
+        Return an idle `connection` to the host of `key` to the pool, the
+        oldest idle connection is closed if there are more than `max_idle`
+        """
+        with self.lock:
+            idle = self.idle.setdefault(key, collections.deque())
+            idle.append((connection, time.monotonic()))
+            while len(idle) > self.max_idle:
+                idle.popleft()[0].close()
+
+    def clear(self) -> None:
+        """
+        Close all idle connections
+        """
+        with self.lock:
+            for idle in self.idle.values():
+                for connection, _ in idle:
+                    connection.close()
+            self.idle = {}
+
+
+# the idle connections are shared with the parent after a fork, see _forget_pools()
+_pools: weakref.WeakSet = weakref.WeakSet()
+
+
+def _proxied() -> bool:
+    """
+    Whether a proxy is configured in the environment, urllib handles it then
+    """
+    return any(os.environ.get(name) for name in ("http_proxy", "https_proxy", "HTTP_PROXY", "HTTPS_PROXY"))
+
+
+def _forget_pools() -> None:
+    """
+    Drop the idle connections in a forked process, only the parent may use them
+    """
+    for pool in list(_pools):
+        pool.lock = threading.Lock()
+        pool.clear()
+
+
+os.register_at_fork(after_in_child=_forget_pools)
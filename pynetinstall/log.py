@@ -1,3 +1,6 @@
+import os
+import queue
+import atexit
 import logging
 
 
@@ -20,13 +23,13 @@ class Logger:
     Methods
     -------
 
-    debug(message, force=False) -> None
+    debug(message, *args, force=False) -> None
         Log a message to the `debug_logger`
 
-    info(message, force=False) -> None
+    info(message, *args, force=False) -> None
         Log a message to the `info_logger`
 
-    error(message, force=False) -> None
+    error(message, *args, force=False) -> None
         Log a message to the `error_logger` 
 
     set_level(level) -> None
@@ -49,7 +52,7 @@ class Logger:
         
         self.set_level(level)
 
-    def debug(self, message: str, force: bool = False) -> None:
+    def debug(self, message: str, *args, force: bool = False) -> None:
         """
         Log Records to the `debug_logger`
 
@@ -57,14 +60,14 @@ class Logger:
         ---------
 
         message : str
-            The message to log
+            The message to log, formatted with the `args` (%-style) only if it is logged
         force : bool
             If the message should be logged even if the `quiet` Attribute is set to True (default: False)
         """
-        if not self.quiet or force:
-            self.debug_logger.debug(message)
+        if (not self.quiet or force) and self.debug_logger.isEnabledFor(logging.DEBUG):
+            self.debug_logger.debug(message, *args)
 
-    def info(self, message: str, force: bool = False) -> None:
+    def info(self, message: str, *args, force: bool = False) -> None:
         """
         Log Records to the `info_logger`
 
@@ -72,14 +75,14 @@ class Logger:
         ---------
 
         message : str
-            The message to log
+            The message to log, formatted with the `args` (%-style) only if it is logged
         force : bool
             If the message should be logged even if the `quiet` Attribute is set to True (default: False)
         """
-        if not self.quiet or force:
-            self.info_logger.info(message)
+        if (not self.quiet or force) and self.info_logger.isEnabledFor(logging.INFO):
+            self.info_logger.info(message, *args)
 
-    def error(self, message: str, force: bool = False) -> None:
+    def error(self, message: str, *args, force: bool = False) -> None:
         """
         Log Records to the `error_logger`
 
@@ -87,12 +90,12 @@ class Logger:
         ---------
 
         message : str
-            The message to log
+            The message to log, formatted with the `args` (%-style) only if it is logged
         force : bool
             If the message should be logged even if the `quiet` Attribute is set to True (default: False)
         """
-        if not self.quiet or force:
-            self.error_logger.error(message)
+        if (not self.quiet or force) and self.error_logger.isEnabledFor(logging.ERROR):
+            self.error_logger.error(message, *args)
 
     def set_level(self, level: int) -> None:
         """
@@ -107,3 +110,90 @@ class Logger:
         self.debug_logger.setLevel(level)
         self.error_logger.setLevel(level)
         self.info_logger.setLevel(level)
+
+
+def default_config() -> None:
+    """
+    Configure the loggers like the logging.ini of the package, without
+    importing logging.config and parsing the file: the pynetinstall loggers
+    write their level to stderr, the root logger only critical records
+    """
+    root = logging.getLogger()
+    root.setLevel(logging.CRITICAL)
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.CRITICAL)
+    root.addHandler(handler)
+
+    formatter = logging.Formatter("%(asctime)s - [%(levelname)-5s] -> %(message)s")
+    for name, level in (("pynet-err", logging.ERROR), ("pynet-inf", logging.INFO), ("pynet-deb", logging.DEBUG)):
+        handler = logging.StreamHandler()
+        handler.setLevel(level)
+        handler.setFormatter(formatter)
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        logger.addHandler(handler)
+
+
+# (QueueHandler, QueueListener) of each logger whose handlers were moved by start_queue()
+_queues: list[tuple] = []
+
+
+def start_queue(names: tuple = ("", "pynet-deb", "pynet-inf", "pynet-err")) -> None:
+    """
+    Move the handlers of the loggers behind a QueueHandler, so the handlers
+    write in a listener thread and a slow stream never blocks the caller.
+    The QueueHandler has the lowest level of the handlers it replaces.
+
+    The listeners are restarted in forked processes and stopped at exit.
+
+    Arguments
+    ---------
+
+    names : tuple
+        The names of the loggers, "" for the root logger (default: the root and the pynetinstall loggers)
+    """
+    # imported here, logging.handlers pulls in pickle and socket
+    import logging.handlers
+
+    for name in names:
+        logger = logging.getLogger(name)
+        handlers = [handler for handler in logger.handlers if not isinstance(handler, logging.handlers.QueueHandler)]
+        if not handlers:
+            continue
+        records = queue.SimpleQueue()
+        handler = logging.handlers.QueueHandler(records)
+        # records no handler writes (e.g. propagated to the critical root handler) are not prepared and queued
+        handler.setLevel(min(original.level for original in handlers))
+        listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        for original in handlers:
+            logger.removeHandler(original)
+        logger.addHandler(handler)
+        listener.start()
+        _queues.append((handler, listener))
+
+
+def stop_queue() -> None:
+    """
+    Write the queued records and stop the listener threads of start_queue()
+
+    The QueueHandlers stay in place, start_queue() must not be called again.
+    """
+    while _queues:
+        _, listener = _queues.pop()
+        listener.stop()
+
+
+def _restart_queue() -> None:
+    """
+    Start new listeners in a forked process, the threads of the parent do not exist there
+    """
+    for index, (handler, listener) in enumerate(_queues):
+        # records queued before the fork are written by the parent
+        handler.queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(handler.queue, *listener.handlers, respect_handler_level=True)
+        listener.start()
+        _queues[index] = (handler, listener)
+
+
+atexit.register(stop_queue)
+os.register_at_fork(after_in_child=_restart_queue)
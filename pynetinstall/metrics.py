@@ -0,0 +1,212 @@
+import bisect
+import threading
+import collections
+
+from pynetinstall.log import Logger
+
+
+class Metrics:
+    """
+    Counters and histograms of the flashes, exposed in the Prometheus text format
+
+    The `Flasher`s record into the Metrics of their `FlashInterface`, serve()
+    makes them available to Prometheus (or curl) over HTTP.
+
+    Attributes
+    ----------
+
+    counters : dict[tuple[str, tuple], float]
+        The value of each counter by name and labels
+    histograms : dict[tuple[str, tuple], list]
+        The bucket counts, sum and count of each histogram by name and labels
+    collectors : list[callable]
+        Functions returning (name, labels, value) of counters that are read
+        when the metrics are rendered, e.g. counters kept by the connections
+
+    Methods
+    -------
+
+    inc(name, value=1, **labels) -> None
+        Increase a counter
+
+    observe(name, value, **labels) -> None
+        Add a value to a histogram
+
+    collect(function) -> None
+        Add a function returning counters to render
+
+    snapshot() -> dict
+        The recorded values, to be merged into the Metrics of another process
+
+    merge(snapshot) -> None
+        Add the values of a snapshot()
+
+    render() -> str
+        The metrics in the Prometheus text format
+
+    serve(port, address="127.0.0.1") -> ThreadingHTTPServer
+        Serve the metrics over HTTP in a background thread
+    """
+    # name: (type, help, buckets)
+    METRICS: dict[str, tuple[str, str, tuple]] = {
+        "pynetinstall_flashes_started_total": ("counter", "Flashes started (devices found)", ()),
+        "pynetinstall_flashes_succeeded_total": ("counter", "Flashes finished successfully", ()),
+        "pynetinstall_flashes_aborted_total": ("counter", "Flashes aborted, by the phase and reason they were aborted for", ()),
+        "pynetinstall_bytes_sent_total": ("counter", "Bytes of files sent to devices", ()),
+        "pynetinstall_chunks_sent_total": ("counter", "Chunks of files sent to devices", ()),
+        "pynetinstall_retransmits_total": ("counter", "Packets sent again because the response was late", ()),
+        "pynetinstall_packets_discarded_total": ("counter", "Received packets that were skipped, by reason", ()),
+        "pynetinstall_plugin_cache_hits_total": ("counter", "Results of the plugin taken from the plugin cache", ()),
+        "pynetinstall_plugin_cache_misses_total": ("counter", "Lookups of the plugin that were not cached", ()),
+        "pynetinstall_phase_duration_seconds": ("histogram", "Duration of the phases of successful flashes",
+                                                (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)),
+        "pynetinstall_ack_rtt_seconds": ("histogram", "Time until a device acknowledged a chunk",
+                                         (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)),
+    }
+
+    def __init__(self, logger: Logger = None) -> None:
+        self.logger = logger
+        self.counters: dict[tuple[str, tuple], float] = collections.defaultdict(float)
+        self.histograms: dict[tuple[str, tuple], list] = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Increase the counter `name` with the `labels` by `value`
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Add `value` to the histogram `name` with the `labels`
+        """
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.METRICS[name][2]
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # one count per bucket and +Inf, the sum and the count
+                histogram = self.histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def collect(self, function) -> None:
+        """
+        Add a function returning an iterable of (name, labels, value) counters,
+        called whenever the metrics are rendered
+        """
+        self.collectors.append(function)
+
+    def snapshot(self) -> dict:
+        """
+        The recorded counters and histograms (without the `collectors`)
+        """
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {key: [list(counts), total, count] for key, (counts, total, count) in self.histograms.items()},
+            }
+
+    def merge(self, snapshot: dict) -> None:
+        """
+        Add the values of a snapshot() taken in a worker process
+        """
+        with self.lock:
+            for key, value in snapshot["counters"].items():
+                self.counters[key] += value
+            for key, (counts, total, count) in snapshot["histograms"].items():
+                histogram = self.histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+                histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                histogram[1] += total
+                histogram[2] += count
+
+    def render(self) -> str:
+        """
+        The metrics in the Prometheus text format (version 0.0.4)
+        """
+        with self.lock:
+            counters = collections.defaultdict(float, self.counters)
+            histograms = {key: [list(counts), total, count] for key, (counts, total, count) in self.histograms.items()}
+        for function in self.collectors:
+            for name, labels, value in function():
+                counters[(name, tuple(sorted(labels.items())))] += value
+
+        lines = []
+        for name, (kind, description, buckets) in self.METRICS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {_value(value)}")
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip([*map(str, buckets), "+Inf"], counts):
+                    cumulative += bucket
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_value(total)}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, address: str = "127.0.0.1"):
+        """
+        Serve the metrics on http://`address`:`port`/metrics in a background thread
+
+        Returns
+        -------
+
+         - ThreadingHTTPServer: The server, shutdown() stops it
+
+        Raises
+        ------
+
+        OSError
+            The port can not be bound
+        """
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.partition("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((address, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        if self.logger:
+            self.logger.info("Serving metrics on http://%s:%d/metrics", address, server.server_address[1])
+        return server
+
+
+def _labels(labels: tuple) -> str:
+    """
+    Format the `labels` as {name="value",...}, empty without labels
+    """
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def _value(value: float) -> str:
+    """
+    Format a sample value without losing precision, integers without a fraction
+    """
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
@@ -1,6 +1,14 @@
+import math
+import time
 import fcntl
+import select
+import queue
+import ctypes
 import socket
 import struct
+import collections
+import threading
+import selectors
 
 from pynetinstall.log import Logger
 from pynetinstall.interface import InterfaceInfo
@@ -19,30 +27,52 @@ class UDPConnection(socket.socket):
 
     mac : bytes
         The MAC Address of the `interface_name` Interface of the Raspberry
+    interface_name : str
+        The name of the interface, None if only the `mac` was given and the socket is not bound to the interface
+    device_addr : tuple
+        The Address Pair the packets for the devices are sent to (default: ("255.255.255.255", 5000))
+    device_ip : str
+        The source IP of the packets sent by the devices (default: "0.0.0.0")
 
     MAX_ERRORS : int
         How often a Function gets repeated before it raises an error
     MAX_BYTES_RECV : int
         The amount of bytes to receive at once
+    SCATTER_GATHER : bool
+        Whether packets are sent with sendmsg() instead of concatenating header and data
+    discarded : collections.Counter
+        How many packets read() and get_interface_info() skipped, by reason
+        ("source": not sent by a device, "short": no complete header,
+        "state": outdated state, "mode": device in bad mode)
 
     Methods
     -------
 
     _get_source_mac() -> None
         Get the `mac` Address of the Raspberry
+
+    attach_filter() -> None
+        Let the kernel drop packets that are not sent by a device
     
     read(state) -> tuple
         Read data from the Connection
 
-    write(data, state, recv_addr=("255.255.255.255", 5000)) -> None
+    write(data, state, dev_mac, recv_addr=None) -> None
         Write `data` to the Connection
 
+    forget(dev_mac) -> None
+        Remove the headers built for the device
+
     get_interface_info() -> tuple
         Resolve some information about the Interface
     """
     mac: bytes
+    SO_ATTACH_FILTER: int = 26
+    SO_BINDTODEVICE: int = getattr(socket, "SO_BINDTODEVICE", 25)
+    SCATTER_GATHER: bool = hasattr(socket.socket, "sendmsg")
 
     def __init__(self, addr: tuple = ("0.0.0.0", 5000), interface_name: str = None, mac_address: str = None, error_repeat: int = 25, logger: Logger = None, timeout: int = 60,
+                 device_addr: tuple = None, kernel_filter: bool = False, bind_interface: bool = False,
                  family: socket.AddressFamily or int = socket.AF_INET, kind: socket.SocketKind or int = socket.SOCK_DGRAM, *args, **kwargs) -> None:
         """
         Initialize a new UDPConnection
@@ -67,24 +97,86 @@ class UDPConnection(socket.socket):
             How often a function is repeated until it gets the right response or it raises an error (default: 25)
         timeout : int
             Time in seconds to wait for responses from devices before aborting (default: 60)
+        device_addr : optional[tuple]
+            Send to and accept packets from this Address Pair instead of broadcasting,
+            e.g. to talk to `pynetinstall.emulator` on localhost (default: None)
+        kernel_filter : bool
+            Drop unrelated packets in the kernel, see attach_filter() (default: False)
+        bind_interface : bool
+            Only send and receive on the interface (SO_BINDTODEVICE, Linux only), so several
+            UDPConnections can listen on the same port of different interfaces (default: False)
         """
         super().__init__(family, kind, *args, **kwargs)
         self.logger = logger
         self.MAX_ERRORS = error_repeat
-        self.MAX_BYTES_RECV = 1024
-        self.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self.bind(addr)
-        self.settimeout(timeout)
+        self.MAX_BYTES_RECV = 1500
+        self.discarded = collections.Counter()
+        self._frames: dict[bytes, tuple[bytes, bytearray]] = {}
+        if device_addr:
+            self.device_addr, self.device_ip = device_addr, device_addr[0]
+        else:
+            self.device_addr, self.device_ip = ("255.255.255.255", 5000), "0.0.0.0"
+        self.interface_name = interface_name
+        self.bind_interface = bind_interface
         if interface_name:
             self.mac = self._get_source_mac(interface_name)
         elif mac_address:
             if isinstance(mac_address, str):
                 mac_address = bytes.fromhex(mac_address.replace(':', ''))
             self.mac = mac_address
+            if bind_interface:
+                self.interface_name = find_interface(mac_address)
         else:
             raise ValueError("neither interface_name nor mac_address provided")
-        self.logger.debug(f"A New UDPConnection is created on {addr}")
+        self._bind(addr)
+        self.settimeout(timeout)
+        self._poll = select.poll()
+        self._poll.register(self, select.POLLIN)
+        if kernel_filter:
+            self.attach_filter()
+        self.logger.debug("A New UDPConnection is created on %s", addr)
+
+    def _bind(self, addr: tuple) -> None:
+        """
+        Set the socket options and bind the socket to `addr`
+        """
+        self.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        if self.bind_interface:
+            # without it every UDPConnection on the port would receive the broadcasts of all interfaces
+            self.setsockopt(socket.SOL_SOCKET, self.SO_BINDTODEVICE, self.interface_name.encode())
+        self.bind(addr)
+
+    def attach_filter(self) -> None:
+        """
+        Attach a classic BPF program to the socket (SO_ATTACH_FILTER, Linux only),
+        so the kernel drops packets that are not sent from `device_ip` and
+        our own packets before they wake up read().
+        """
+        code = self._filter_program()
+        program = ctypes.create_string_buffer(b"".join(struct.pack("HBBI", *instruction) for instruction in code))
+        fprog = struct.pack("HP", len(code), ctypes.addressof(program))
+        self.setsockopt(socket.SOL_SOCKET, self.SO_ATTACH_FILTER, fprog)
+        self.logger.debug("Attached a socket filter for packets from %s", self.device_ip)
+
+    def _filter_program(self) -> list[tuple[int, int, int, int]]:
+        """
+        The BPF program attached by attach_filter() as (code, jt, jf, k) tuples.
+        For UDP sockets, offset 0 is the UDP header, the IP header is reached
+        through the SKF_NET_OFF extension.
+        """
+        ip = int.from_bytes(socket.inet_aton(self.device_ip), "big")
+        mac_high, mac_low = int.from_bytes(self.mac[:4], "big"), int.from_bytes(self.mac[4:], "big")
+        return [
+            (0x20, 0, 0, (-0x100000 + 12) & 0xffffffff), # ld [SKF_NET_OFF + 12]  IP source
+            (0x15, 0, 5, ip),                            # jeq device_ip, else drop
+            (0x20, 0, 0, 8),                             # ld [8]                 source MAC (first 4 bytes)
+            (0x15, 0, 2, mac_high),                      # jeq our MAC, else accept
+            (0x28, 0, 0, 12),                            # ldh [12]               source MAC (last 2 bytes)
+            (0x15, 1, 0, mac_low),                       # jeq our MAC, drop, else accept
+            (0x06, 0, 0, 0x40000),                       # ret accept
+            (0x06, 0, 0, 0),                             # ret drop
+        ]
 
     def _get_source_mac(self, interface_name) -> None:
         """
@@ -92,64 +184,82 @@ class UDPConnection(socket.socket):
         """
         arg = struct.pack('256s', bytes(interface_name, 'utf-8')[:15])
         mac = fcntl.ioctl(self.fileno(), 0x8927, arg)[18:24]  # 0x8927: SIOCGIFHWADDR
-        self.logger.debug(f"The MAC-Address of the Interface {interface_name} is {mac}")
+        self.logger.debug("The MAC-Address of the Interface %s is %s", interface_name, mac)
         return mac
 
-    def read(self, state: list, _repeated = 0) -> tuple[bytes, list] or None:
+    def read(self, state: list, timeout: float = None) -> tuple[bytes, list] or None:
         """
         Reads `MAX_BYTES_RECV` (int) from the socket and returns the bytes.
 
-        This function also checks if the message was sent by the Raspberry Server
-        and restarts the function if this happens (As long as `_repeated` is smaller than `MAX_ERRORS`).
+        This function also skips messages that were not sent by a Routerboard
+        (e.g. our own broadcasts) or have an outdated state, as long as less
+        than `MAX_ERRORS` packets were skipped. The skipped packets are counted
+        in `discarded` by reason.
 
         Arguments
         ---------
 
         state : tuple
             The State of the Flash Process [Server State, Interface State]
+        timeout : float
+            Time in seconds to wait for the response, including skipped packets (default: the timeout of the socket)
 
         Returns
         -------
         
          - bytes: The data received from the Interface, or None on error
          - list: The State displayed in the Header of the UDPPacket, or None on error
-        """
 
-        data, addr = self.recvfrom(self.MAX_BYTES_RECV)
+        Raises
+        ------
+
+        TimeoutError
+            No packet with the right state was received within `timeout` seconds
+        """
+        default = self.gettimeout()
+        if timeout is None:
+            timeout = default
+        deadline = None if timeout is None else time.monotonic() + timeout
         header_state = []
+        for repeated in range(self.MAX_ERRORS + 1):
+            # wait with poll() after a skipped packet or for a custom timeout, changing the socket timeout costs two syscalls per packet
+            if deadline is not None and (repeated or timeout != default):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._poll.poll(math.ceil(remaining * 1000)):
+                    raise TimeoutError("timed out")
+            data, addr = self.recvfrom(self.MAX_BYTES_RECV)
 
-        # since we listen for broadcasts, we also receive any packets we sent ourselves, so we have to filter out packets with our ip in src
-        if addr[0] == "0.0.0.0": # Routerboard sets this as srcip
-            # The fist 6 bytes are the MAC Address of the source 
-            header_mac: bytes = data[:6]
+            # since we listen for broadcasts, we also receive any packets we sent ourselves, so we have to filter out packets with our ip in src
+            if addr[0] != self.device_ip: # Routerboard sets 0.0.0.0 as srcip
+                self.discarded["source"] += 1
+                continue
+            if len(data) < 20:
+                self.discarded["short"] += 1
+                continue
             # From bytes 16 to 20 the states are displayed
             header_state: list[int] = [*struct.unpack("<HH", data[16:20])]
             if header_state == state: # state not updated (happens during OFFR and FILE commands) means the device is not yet ready to continue
                 return data[6:], header_state
+            self.discarded["state"] += 1
 
-        # otherwise, likely received an unrelated packet (wrong srcip or state)
-        _repeated += 1
-        if _repeated > self.MAX_ERRORS:
-            self.logger.debug(f"State is {header_state}, but should be {state} (tried {_repeated} times), aborting.")
-            return None, None
+        self.logger.debug("State is %s, but should be %s (tried %d times), aborting.", header_state, state, self.MAX_ERRORS + 1)
+        return None, None
 
-        return self.read(state, _repeated)
-
-    def write(self, data: bytes, state: list, dev_mac: bytes, recv_addr: tuple = ("255.255.255.255", 5000)) -> None:
+    def write(self, data: bytes, state: list, dev_mac: bytes, recv_addr: tuple = None) -> None:
         """
         Write a Broadcast message to all the connected interfaces including the data.
 
         Arguments
         ---------
 
-        data : bytes
+        data : bytes or memoryview
             The `data` to send to the Interface
         state : list
             A list of the current State of the Flash [Server State, Interface State]
         dev_mac : bytes
             The MAC Address of the Interface
         recv_addr : tuple
-            A Address pair to where the Connection sends the data to (default: ("255.255.255.255, 5000))
+            A Address pair to where the Connection sends the data to (default: `device_addr`)
         """
         # Overview of the Data
         # 1. The MAC Address of the source          (6 bytes)
@@ -159,8 +269,39 @@ class UDPConnection(socket.socket):
         # 5. The State of the Server                (2 bytes)
         # 6. The State of the Client                (2 bytes)
         # 7. The data                               (? bytes)
-        message = self.mac + dev_mac + struct.pack("<HHHH", 0, len(data), state[1], state[0]) + data
-        self.sendto(message, recv_addr)
+        # the data is sent without copying it into one message with the header (scatter-gather)
+        prefix, header = self._header(data, state, dev_mac)
+        if self.SCATTER_GATHER:
+            self.sendmsg((prefix, header, data), (), 0, recv_addr or self.device_addr)
+        else:
+            self.sendto(b"".join((prefix, header, data)), recv_addr or self.device_addr)
+
+    def _header(self, data: bytes, state: list, dev_mac: bytes) -> tuple[bytes, bytearray]:
+        """
+        The header of a packet with `data` for the device `dev_mac`, see write()
+
+        The MAC Addresses are built once per device, the length and state
+        are packed into a buffer that is reused for each packet of the device.
+
+        Returns
+        -------
+
+         - bytes: The MAC Addresses of the source and the destination
+         - bytearray: The length of the data and the state
+        """
+        try:
+            prefix, header = self._frames[dev_mac]
+        except KeyError:
+            prefix, header = self._frames[dev_mac] = (self.mac + dev_mac, bytearray(8))
+        struct.pack_into("<HHHH", header, 0, 0, len(data), state[1], state[0])
+        return prefix, header
+
+    def forget(self, dev_mac: bytes) -> None:
+        """
+        Remove the headers built for the device `dev_mac` by write(), called
+        when its flash ended so the headers of past devices are not kept
+        """
+        self._frames.pop(dev_mac, None)
 
     def get_interface_info(self) -> InterfaceInfo:
         r"""
@@ -188,16 +329,449 @@ class UDPConnection(socket.socket):
         except TimeoutError:
             return None
 
-        if addr[0] == "0.0.0.0": # see self.read() for details.
+        if addr[0] != self.device_ip: # see self.read() for details.
+            self.discarded["source"] += 1
+        elif len(data) < 20:
+            self.discarded["short"] += 1
+        else:
             header_state = [*struct.unpack("<HH", data[16:20])]
             if header_state == [1, 0]:
                 mac  = data[:6].hex(':').upper()
-                self.logger.debug(f"Interface Found: {mac}")
+                self.logger.debug("Interface Found: %s", mac)
                 return InterfaceInfo.from_data(data)
             else:
                 # right after flashing failed, the device will send a lot of
                 # RETR and WTRM (retry, terminate) packets. we just ignore them
                 # and wait for the device to be removed.
-                self.logger.debug(f"found device in bad mode: {data[20:24]} (state {header_state})")
+                self.logger.debug("found device in bad mode: %s (state %s)", data[20:24], header_state)
+                self.discarded["mode"] += 1
 
         return None
+
+
+class L2Connection(UDPConnection):
+    """
+    `Subclass of UDPConnection`
+
+    Sends the packets as raw ethernet frames (AF_PACKET, Linux only) to the
+    MAC Address of the device instead of broadcasting them, so devices that
+    are flashed at the same time on one segment do not receive each other's
+    firmware and the station does not receive its own packets.
+
+    The Ethernet, IP and UDP headers are built by write() and stripped by
+    recvfrom(), so read() and get_interface_info() work as for UDPConnection.
+
+    Attributes
+    ----------
+
+    interface_name : str
+        The name of the interface the socket is bound to
+    port : int
+        The UDP port of the netinstall protocol (default: 5000)
+    ip : bytes
+        The IP Address of the interface, used as source of the packets (0.0.0.0 if it has none)
+    """
+    ETH_P_IP: int = 0x0800
+
+    def __init__(self, interface_name: str = None, mac_address: str = None, port: int = 5000, logger: Logger = None,
+                 kernel_filter: bool = True, **kwargs) -> None:
+        """
+        Initialize a new L2Connection
+
+        Arguments
+        ---------
+
+        interface_name : optional[str]
+            The name of the interface where the Interface is connected to
+        mac_address : optional[str|bytes]
+            The mac address of the interface, used to look up its name if `interface_name` is not given
+        port : int
+            The UDP port of the netinstall protocol (default: 5000)
+        kernel_filter : bool
+            Drop all frames but the packets of the devices in the kernel, without
+            the filter every IP packet on the interface wakes up read() (default: True)
+
+        The other arguments are passed to UDPConnection.
+        """
+        if not interface_name:
+            if isinstance(mac_address, str):
+                mac_address = bytes.fromhex(mac_address.replace(':', ''))
+            interface_name = find_interface(mac_address)
+        self.interface_name = interface_name
+        self.port = port
+        self._ip_headers: dict[tuple[bytes, tuple], tuple[bytes, int]] = {}
+        super().__init__(addr=(interface_name, self.ETH_P_IP), interface_name=interface_name, logger=logger, kernel_filter=False,
+                         family=socket.AF_PACKET, kind=socket.SOCK_RAW, proto=socket.htons(self.ETH_P_IP), **kwargs)
+        self.ip = get_interface_ip(interface_name)
+        if kernel_filter:
+            self.attach_filter()
+
+    def _bind(self, addr: tuple) -> None:
+        """
+        Bind the packet socket to the interface
+        """
+        self.bind(addr)
+
+    def recvfrom(self, bufsize: int) -> tuple[bytes, tuple]:
+        """
+        Receive one frame and strip its Ethernet, IP and UDP headers
+
+        Returns
+        -------
+
+         - bytes: The UDP payload
+         - tuple: The source Address Pair; ("", 0) for frames that are not
+           received UDP packets to `port`, so read() discards them
+        """
+        frame, addr = super().recvfrom(bufsize + 64)
+        if len(frame) < 42:
+            return b"", ("", 0)
+        start = 14 + (frame[14] & 0x0f) * 4 # the IP header may contain options
+        if addr[2] == socket.PACKET_OUTGOING or frame[23] != 17 or int.from_bytes(frame[start + 2:start + 4], "big") != self.port:
+            return b"", ("", 0)
+        return frame[start + 8:], (socket.inet_ntoa(frame[26:30]), int.from_bytes(frame[start:start + 2], "big"))
+
+    def write(self, data: bytes, state: list, dev_mac: bytes, recv_addr: tuple = None) -> None:
+        """
+        Send the `data` to the device with the MAC Address `dev_mac`
+
+        Arguments
+        ---------
+
+        data : bytes or memoryview
+            The `data` to send to the Interface
+        state : list
+            A list of the current State of the Flash [Server State, Interface State]
+        dev_mac : bytes
+            The MAC Address of the Interface, used as destination of the ethernet frame
+        recv_addr : tuple
+            The destination IP Address and UDP port (default: `device_addr`)
+        """
+        prefix, header = self._header(data, state, dev_mac)
+        length = 28 + len(prefix) + len(header) + len(data)
+        # the headers only differ in the length fields and the IP checksum, the sum of all other words is built once per device and address
+        recv_addr = recv_addr or self.device_addr
+        try:
+            l2_header, partial = self._ip_headers[dev_mac, recv_addr]
+        except KeyError:
+            ip, port = recv_addr
+            l2_header = bytearray(dev_mac + self.mac + struct.pack("!H", self.ETH_P_IP)
+                                 + struct.pack("!BBHHHBBH4s4s", 0x45, 0, 0, 0, 0, 64, 17, 0, self.ip, socket.inet_aton(ip))
+                                 + struct.pack("!HHHH", self.port, port, 0, 0)) # UDP checksum 0: not computed
+            partial = sum(struct.unpack("!10H", l2_header[14:34]))
+            self._ip_headers[dev_mac, recv_addr] = (l2_header, partial)
+        checksum = partial + length
+        checksum = (checksum & 0xffff) + (checksum >> 16)
+        checksum = ~((checksum & 0xffff) + (checksum >> 16)) & 0xffff
+        struct.pack_into("!H", l2_header, 16, length)
+        struct.pack_into("!H", l2_header, 24, checksum)
+        struct.pack_into("!H", l2_header, 38, length - 20)
+        self.sendmsg((l2_header, prefix, header, data))
+
+    def forget(self, dev_mac: bytes) -> None:
+        """
+        Remove the headers built for the device `dev_mac` by write()
+        """
+        super().forget(dev_mac)
+        for key in [key for key in self._ip_headers if key[0] == dev_mac]:
+            del self._ip_headers[key]
+
+    def _filter_program(self) -> list[tuple[int, int, int, int]]:
+        """
+        The BPF program attached by attach_filter(), offsets are relative to
+        the ethernet header (assuming IP headers without options)
+        """
+        ip = int.from_bytes(socket.inet_aton(self.device_ip), "big")
+        mac_high, mac_low = int.from_bytes(self.mac[:4], "big"), int.from_bytes(self.mac[4:], "big")
+        return [
+            (0x20, 0, 0, (-0x1000 + 4) & 0xffffffff),   # ld [SKF_AD_OFF + SKF_AD_PKTTYPE]
+            (0x15, 11, 0, socket.PACKET_OUTGOING),      # jeq outgoing, drop
+            (0x30, 0, 0, 23),                           # ldb [23]  IP protocol
+            (0x15, 0, 9, 17),                           # jeq UDP, else drop
+            (0x28, 0, 0, 36),                           # ldh [36]  UDP destination port
+            (0x15, 0, 7, self.port),                    # jeq port, else drop
+            (0x20, 0, 0, 26),                           # ld [26]   IP source
+            (0x15, 0, 5, ip),                           # jeq device_ip, else drop
+            (0x20, 0, 0, 42),                           # ld [42]   source MAC (first 4 bytes)
+            (0x15, 0, 2, mac_high),                     # jeq our MAC, else accept
+            (0x28, 0, 0, 46),                           # ldh [46]  source MAC (last 2 bytes)
+            (0x15, 1, 0, mac_low),                      # jeq our MAC, drop, else accept
+            (0x06, 0, 0, 0x40000),                      # ret accept
+            (0x06, 0, 0, 0),                            # ret drop
+        ]
+
+
+def find_interface(mac: bytes) -> str:
+    """
+    Find the name of the interface with the MAC Address `mac` (Linux only)
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for _, name in socket.if_nameindex():
+            arg = struct.pack('256s', bytes(name, 'utf-8')[:15])
+            if fcntl.ioctl(sock.fileno(), 0x8927, arg)[18:24] == mac: # 0x8927: SIOCGIFHWADDR
+                return name
+    raise ValueError(f"no interface with the MAC Address {mac.hex(':')}")
+
+
+def get_interface_ip(interface_name: str) -> bytes:
+    """
+    The IPv4 Address of the interface `interface_name`, 0.0.0.0 if it has none (Linux only)
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            arg = struct.pack('256s', bytes(interface_name, 'utf-8')[:15])
+            return fcntl.ioctl(sock.fileno(), 0x8915, arg)[20:24] # 0x8915: SIOCGIFADDR
+        except OSError:
+            return bytes(4)
+
+
+class DeviceChannel:
+    """
+    A per-device view of a shared `UDPConnection`
+
+    The `Dispatcher` reads all packets from the socket and puts the ones sent
+    by `mac` into the `queue` of this channel. It provides the same `read()`
+    and `write()` functions as `UDPConnection`, so a `Flasher` can use it
+    as its connection while other devices are flashed on the same socket.
+
+    Attributes
+    ----------
+
+    connection : UDPConnection
+        The Connection used to send packets to the device
+    mac : bytes
+        The MAC Address of the device this channel belongs to
+    queue : queue.Queue or PipeQueue
+        The packets received from the device, a PipeQueue if the device is flashed in another process
+    timeout : float
+        Time in seconds to wait for responses from the device (default: the timeout of the `connection`)
+    discarded : collections.Counter
+        How many packets read() skipped, by reason ("state": outdated state)
+
+    Methods
+    -------
+
+    put(data) -> None
+        Hand a packet received from the device to the channel
+
+    read(state) -> tuple
+        Read data from the device
+
+    write(data, state, dev_mac) -> None
+        Write `data` to the device
+    """
+    def __init__(self, connection: UDPConnection, mac: bytes, timeout: float = None, packets: object = None) -> None:
+        self.connection = connection
+        self.logger = connection.logger
+        self.mac = mac
+        self.queue = queue.Queue() if packets is None else packets
+        self.MAX_ERRORS = connection.MAX_ERRORS
+        self.timeout = connection.gettimeout() if timeout is None else timeout
+        self.discarded = collections.Counter()
+
+    def put(self, data: bytes) -> None:
+        """
+        Hand a packet received from the device to the channel
+        """
+        self.queue.put(data)
+
+    def read(self, state: list, timeout: float = None) -> tuple[bytes, list] or None:
+        """
+        Reads the next packet of the device and returns the bytes.
+
+        Packets with an outdated state are skipped (As long as less than
+        `MAX_ERRORS` packets were skipped), see `UDPConnection.read()`.
+
+        Arguments
+        ---------
+
+        state : list
+            The State of the Flash Process [Server State, Interface State]
+        timeout : float
+            Time in seconds to wait for the response, including skipped packets (default: `timeout`)
+
+        Returns
+        -------
+
+         - bytes: The data received from the Interface, or None on error
+         - list: The State displayed in the Header of the UDPPacket, or None on error
+
+        Raises
+        ------
+
+        TimeoutError
+            The device did not send anything within `timeout` seconds
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        for _ in range(self.MAX_ERRORS + 1):
+            try:
+                data = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise TimeoutError("timed out")
+            header_state = [*struct.unpack("<HH", data[16:20])]
+            if header_state == state:
+                return data[6:], header_state
+            self.discarded["state"] += 1
+
+        self.logger.debug("State is %s, but should be %s (tried %d times), aborting.", header_state, state, self.MAX_ERRORS + 1)
+        return None, None
+
+    def write(self, data: bytes, state: list, dev_mac: bytes, recv_addr: tuple = None) -> None:
+        """
+        Write `data` to the device using the shared `connection`
+        """
+        self.connection.write(data, state, dev_mac, recv_addr)
+
+
+class Dispatcher:
+    """
+    Demultiplexes the packets received on one or more `UDPConnection`s
+    (usually one per network interface) by the MAC Address of the sending device.
+
+    Packets of devices that are currently being flashed are passed to their
+    `DeviceChannel`; announcements of new devices are returned by `poll()`.
+
+    Attributes
+    ----------
+
+    connections : list[UDPConnection]
+        The Connections to read the packets from
+    channels : dict[bytes, DeviceChannel]
+        The channels of the devices that are currently being flashed
+
+    Methods
+    -------
+
+    open(mac, connection, packets=None) -> DeviceChannel
+        Create a channel for the device with the MAC Address `mac`
+
+    close(mac) -> None
+        Remove the channel of the device
+
+    poll(timeout) -> list[tuple[InterfaceInfo, UDPConnection]]
+        Dispatch the received packets and return newly announced devices
+
+    shutdown() -> None
+        Stop watching the `connections`
+    """
+    def __init__(self, connections: list[UDPConnection] or UDPConnection, logger: Logger = None) -> None:
+        if isinstance(connections, UDPConnection):
+            connections = [connections]
+        self.connections = connections
+        self.logger = logger or connections[0].logger
+        self.channels: dict[bytes, DeviceChannel] = {}
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        for connection in connections:
+            self.selector.register(connection, selectors.EVENT_READ)
+
+    def open(self, mac: bytes, connection: UDPConnection = None, packets: object = None) -> DeviceChannel:
+        """
+        Create a `DeviceChannel` for the device with the MAC Address `mac`,
+        which writes to the `connection` the device was found on (default: the first one)
+        and receives the packets through the `packets` queue (default: a new queue.Queue)
+        """
+        channel = DeviceChannel(connection or self.connections[0], mac, packets=packets)
+        with self.lock:
+            self.channels[mac] = channel
+        return channel
+
+    def close(self, mac: bytes) -> None:
+        """
+        Remove the `DeviceChannel` of the device, further packets sent by it are ignored
+        """
+        with self.lock:
+            channel = self.channels.pop(mac, None)
+        if channel:
+            channel.connection.forget(mac)
+        if channel and isinstance(channel.queue, PipeQueue):
+            channel.queue.close()
+
+    def poll(self, timeout: float = None) -> list[InterfaceInfo]:
+        """
+        Wait up to `timeout` seconds for packets and dispatch them.
+
+        Returns
+        -------
+
+         - list[tuple[InterfaceInfo, UDPConnection]]: The devices that announced themselves
+           and have no open channel, with the connection they were found on
+        """
+        found = []
+        for key, _ in self.selector.select(timeout):
+            data, addr = key.fileobj.recvfrom(key.fileobj.MAX_BYTES_RECV)
+            if addr[0] != key.fileobj.device_ip: # see UDPConnection.read() for details.
+                key.fileobj.discarded["source"] += 1
+                continue
+            if len(data) < 20: # a packet without a complete header would stop the dispatcher
+                key.fileobj.discarded["short"] += 1
+                continue
+            mac = data[:6]
+            with self.lock:
+                channel = self.channels.get(mac)
+            if channel:
+                channel.put(data)
+                continue
+            header_state = [*struct.unpack("<HH", data[16:20])]
+            if header_state == [1, 0]:
+                found.append((InterfaceInfo.from_data(data), key.fileobj))
+            else:
+                self.logger.debug("found device in bad mode: %s (state %s)", data[20:24], header_state)
+                key.fileobj.discarded["mode"] += 1
+        return found
+
+    def shutdown(self) -> None:
+        """
+        Stop watching the `connections`
+        """
+        self.selector.close()
+
+
+class PipeQueue:
+    """
+    Passes the packets of a device to a `DeviceChannel` in a worker process
+
+    Provides the put() and get() functions of queue.Queue used by the
+    `Dispatcher` and the `DeviceChannel` on the two ends of a pipe, so the
+    packets are not pickled and no feeder thread is needed.
+
+    Attributes
+    ----------
+
+    reader : multiprocessing.connection.Connection
+        The end of the pipe read by the worker process
+    writer : multiprocessing.connection.Connection
+        The end of the pipe written by the `Dispatcher`
+    """
+    def __init__(self, context) -> None:
+        self.reader, self.writer = context.Pipe(duplex=False)
+
+    def put(self, data: bytes) -> None:
+        """
+        Send a packet to the worker process, it is dropped if the worker exited
+        """
+        try:
+            self.writer.send_bytes(data)
+        except OSError:
+            pass
+
+    def get(self, timeout: float = None) -> bytes:
+        """
+        Receive the next packet
+
+        Raises
+        ------
+
+        queue.Empty
+            No packet arrived within `timeout` seconds
+        """
+        if not self.reader.poll(timeout):
+            raise queue.Empty
+        return self.reader.recv_bytes()
+
+    def close(self) -> None:
+        """
+        Close both ends of the pipe in this process
+        """
+        self.reader.close()
+        self.writer.close()
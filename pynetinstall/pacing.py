@@ -0,0 +1,181 @@
+import time
+
+
+class Pacer:
+    """
+    Adaptive delay between the packets of a file upload
+
+    Without any delay between two chunks the Routerboard sometimes can not
+    keep up and answers with an outdated state. The Pacer shrinks the delay
+    towards `min_delay` while the device acknowledges every chunk in time and
+    backs off as soon as state errors are reported.
+
+    Attributes
+    ----------
+
+    delay : float
+        The current delay between two chunks in seconds (default: 0.005)
+    min_delay : float
+        The lowest delay the Pacer shrinks to (default: 0)
+    max_delay : float
+        The highest delay the Pacer backs off to (default: 0.05)
+    chunks : int
+        How many chunks were recorded
+    bytes : int
+        How many bytes were recorded
+    errors : int
+        How many state errors were recorded
+    slept : float
+        The time in seconds spent waiting in wait()
+    rtt : float
+        The smoothed round-trip time of a chunk in seconds (None until the first chunk)
+
+    Methods
+    -------
+
+    record(size, rtt, errors=0) -> None
+        Record an acknowledged chunk and adapt the `delay`
+
+    wait() -> None
+        Sleep for the current `delay`
+
+    stats() -> dict
+        The statistics of the Pacer
+    """
+    STEP: float = 0.001
+    DECREASE: float = 0.95
+    INCREASE: float = 2.0
+
+    def __init__(self, delay: float = 0.005, min_delay: float = 0.0, max_delay: float = 0.05) -> None:
+        self.delay = delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.chunks = 0
+        self.bytes = 0
+        self.errors = 0
+        self.slept = 0.0
+        self.rtt = None
+        self.rtt_total = 0.0
+
+    def record(self, size: int, rtt: float, errors: int = 0) -> None:
+        """
+        Record an acknowledged chunk and adapt the `delay`
+
+        Arguments
+        ---------
+
+        size : int
+            The amount of bytes in the chunk
+        rtt : float
+            Time in seconds between sending the chunk and receiving the acknowledgement
+        errors : int
+            How many state errors occurred while waiting for the acknowledgement (default: 0)
+        """
+        self.chunks += 1
+        self.bytes += size
+        self.rtt_total += rtt
+        self.rtt = rtt if self.rtt is None else 0.875 * self.rtt + 0.125 * rtt
+        if errors:
+            self.errors += errors
+            self.delay = min(self.max_delay, max(self.delay * self.INCREASE, self.STEP))
+        else:
+            self.delay *= self.DECREASE
+            if self.delay < self.STEP / 10:
+                self.delay = 0.0
+        self.delay = max(self.delay, self.min_delay)
+
+    def wait(self) -> None:
+        """
+        Sleep for the current `delay`
+        """
+        if self.delay > 0:
+            time.sleep(self.delay)
+            self.slept += self.delay
+
+    def stats(self) -> dict:
+        """
+        The statistics of the Pacer
+
+        Returns
+        -------
+
+         - dict: the current delay, chunks, bytes, errors, time slept,
+           smoothed rtt and the throughput in bytes per second
+        """
+        busy = self.rtt_total + self.slept
+        return {
+            "delay": self.delay,
+            "chunks": self.chunks,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "slept": self.slept,
+            "rtt": self.rtt,
+            "throughput": self.bytes / busy if busy else 0.0,
+        }
+
+
+class RetransmitTimer:
+    """
+    Retransmission timeout (RTO) of the packets sent to a device
+
+    The timeout is derived from the measured round-trip times as in RFC 6298
+    (smoothed RTT plus four times its variation), so a lost packet is sent
+    again after a few milliseconds instead of waiting for the timeout of the
+    connection. Each retransmission doubles the timeout until the next
+    round-trip time is measured.
+
+    Attributes
+    ----------
+
+    srtt : float
+        The smoothed round-trip time in seconds (None until the first sample)
+    rttvar : float
+        The variation of the round-trip time in seconds
+    rto : float
+        The current retransmission timeout in seconds (default: 0.5 until the first sample)
+    min_rto : float
+        The lowest timeout, to not retransmit packets the device is still handling (default: 0.05)
+    max_rto : float
+        The highest timeout after backing off (default: 2)
+    retransmits : int
+        How many packets were retransmitted
+
+    Methods
+    -------
+
+    sample(rtt) -> None
+        Update the timeout with a measured round-trip time
+
+    backoff() -> None
+        Double the timeout after a retransmission
+    """
+    ALPHA: float = 1 / 8
+    BETA: float = 1 / 4
+    K: int = 4
+
+    def __init__(self, rto: float = 0.5, min_rto: float = 0.05, max_rto: float = 2.0) -> None:
+        self.srtt = None
+        self.rttvar = 0.0
+        self.rto = rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.retransmits = 0
+
+    def sample(self, rtt: float) -> None:
+        """
+        Update the timeout with the round-trip time of a packet that was not
+        retransmitted (Karn's algorithm)
+        """
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + self.K * self.rttvar))
+
+    def backoff(self) -> None:
+        """
+        Count a retransmission and double the timeout
+        """
+        self.retransmits += 1
+        self.rto = min(self.max_rto, self.rto * 2)
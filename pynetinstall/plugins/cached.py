@@ -0,0 +1,156 @@
+import time
+import threading
+import collections
+
+from pynetinstall.log import Logger
+from pynetinstall.interface import InterfaceInfo
+
+
+class CachedPlugin:
+    """
+    Caches the results of the get_files() function of another plugin
+
+    Plugins that look up the files in an inventory or DCIM system are asked
+    once per `key` within `ttl` seconds, instead of once per device and retry.
+    Only results made of paths and URLs (strings) are cached, a file object
+    can only be uploaded once.
+
+    Enabled in the configuration file:
+
+        [pynetinstall]
+        plugin=<PYTHON_MODULE>:<CLASS_NAME>
+        plugin_cache=model,arch
+        plugin_cache_ttl=300
+        plugin_cache_entries=1024
+
+    Attributes
+    ----------
+
+    plugin : object
+        The plugin whose results are cached
+    key : tuple[str]
+        The attributes of the InterfaceInfo identifying a result, e.g. ("mac",)
+        per device or ("model", "arch", "min_os") for the same files on every device of a model
+    ttl : float
+        How many seconds a result is used, 0 to keep it until it is evicted (default: 300)
+    max_entries : int
+        How many results are kept, the least recently used are evicted first (default: 1024)
+    hits : int
+        How many results were taken from the cache
+    misses : int
+        How often the `plugin` was asked
+    evictions : int
+        How many results were removed because the cache was full
+
+    Methods
+    -------
+
+    get_files(info) -> tuple
+        The files of the `plugin` for the device, cached by the `key`
+
+    get_digest(file) -> str or None
+        The expected SHA-256 digest of a file from the `plugin`, if it has a get_digest() function
+
+    stats() -> dict
+        The hits, misses, evictions and entries of the cache
+
+    clear() -> None
+        Remove all results
+
+    close() -> None
+        Remove all results and close the `plugin`, if it has a close() function
+    """
+    KEYS: tuple = ("mac", "model", "arch", "min_os", "lic_id", "lic_key")
+
+    def __init__(self, plugin, key: tuple = ("mac",), ttl: float = 300, max_entries: int = 1024, logger: Logger = None) -> None:
+        """
+        Raises
+        ------
+
+        ValueError
+            The `key` contains an attribute that the InterfaceInfo does not have
+        """
+        unknown = [name for name in key if name not in self.KEYS]
+        if not key or unknown:
+            raise ValueError(f"Invalid plugin_cache key {', '.join(unknown)!r}, use one or more of {', '.join(self.KEYS)}")
+        self.plugin = plugin
+        self.key = tuple(key)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.logger = logger
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries: collections.OrderedDict[tuple, tuple[float, tuple]] = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.key_locks: dict[tuple, threading.Lock] = {}
+
+    def get_files(self, info: InterfaceInfo) -> tuple:
+        """
+        The files of the `plugin` for the device, taken from the cache if a
+        result with the same `key` is younger than `ttl` seconds
+        """
+        key = tuple(getattr(info, name) for name in self.key)
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        # devices with the same key that are discovered at once wait for the first lookup
+        with key_lock:
+            try:
+                now = time.monotonic()
+                with self.lock:
+                    entry = self.entries.get(key)
+                    if entry is not None and (not self.ttl or now - entry[0] < self.ttl):
+                        self.entries.move_to_end(key)
+                        self.hits += 1
+                        return entry[1]
+                    self.misses += 1
+
+                files = tuple(self.plugin.get_files(info))
+                if all(file is None or isinstance(file, str) for file in files):
+                    with self.lock:
+                        self.entries[key] = (now, files)
+                        self.entries.move_to_end(key)
+                        while len(self.entries) > self.max_entries:
+                            evicted, _ = self.entries.popitem(last=False)
+                            self.key_locks.pop(evicted, None)
+                            self.evictions += 1
+                elif self.logger:
+                    self.logger.debug("Not caching the files of %s, the plugin returned file objects", info.mac.hex(':'))
+                return files
+            finally:
+                # the lock of a key without a result (file objects, errors) would never be removed
+                with self.lock:
+                    if key not in self.entries:
+                        self.key_locks.pop(key, None)
+
+    def get_digest(self, file) -> str or None:
+        """
+        The expected SHA-256 digest of a `file` of get_files() from the
+        `plugin`, not cached, None if the `plugin` has no get_digest() function
+        """
+        get_digest = getattr(self.plugin, "get_digest", None)
+        return get_digest(file) if get_digest is not None else None
+
+    def stats(self) -> dict:
+        """
+        The hits, misses, evictions and entries of the cache
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.entries)}
+
+    def clear(self) -> None:
+        """
+        Remove all results
+        """
+        with self.lock:
+            self.entries.clear()
+            self.key_locks.clear()
+
+    def close(self) -> None:
+        """
+        Remove all results and close the `plugin`, if it has a close() function
+        """
+        self.clear()
+        close = getattr(self.plugin, "close", None)
+        if close is not None:
+            close()
@@ -0,0 +1,238 @@
+import os
+import csv
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from configparser import ConfigParser
+
+from pynetinstall.interface import InterfaceInfo
+
+
+class Plugin:
+    """
+    A Plugin selecting the files of each device from an inventory
+
+    The inventory is a CSV file (with a header row) or a JSON list of
+    objects with the columns `mac`, `lic_id`, `model`, `firmware`, `config`
+    and `additional_packages` (separated by spaces). A device gets the files
+    of the row with its MAC Address, else of the row with its license ID
+    (and no MAC Address), else of the row with its model (and neither MAC
+    Address nor license ID), else the defaults of the configuration. Empty
+    columns of a row fall back to the defaults as well.
+
+    The rows are stored in an SQLite database indexed by MAC Address,
+    license ID and model, so a lookup does not scan the inventory. When the
+    inventory changes, only the rows that changed are written again. An
+    inventory that can not be read (e.g. while it is written) is logged and
+    the previous index is kept.
+
+        [pynetinstall]
+        plugin=pynetinstall.plugins.inventory:Plugin
+
+        [inventory]
+        source=<PATH_TO_CSV_OR_JSON>
+        database=<PATH_TO_SQLITE_DATABASE>  # default: the source with .sqlite appended
+        firmware=<DEFAULT_ROUTEROS_NPK>
+        config=<DEFAULT_CONFIG_RSC>
+
+    Attributes
+    ----------
+
+    source : str
+        The inventory file
+    database : str
+        The SQLite database the inventory is indexed in
+    firmware : str
+        The firmware of devices without a (matching) row, or None
+    default_config : str
+        The configuration of devices without a (matching) row, or None
+    version : tuple
+        The modification time and size of the `source` that is indexed
+    failed : tuple
+        The modification time and size of the `source` that could not be read, or None
+
+    Methods
+    -------
+
+    get_files(info) -> tuple[str]
+        The files of the device from the inventory
+
+    update() -> None
+        Index the `source` again if it changed
+
+    close() -> None
+        Close the database
+
+    Raises
+    ------
+
+    KeyError
+        The inventory is not defined in the configuration
+    ValueError
+        The inventory does not exist or can not be read
+    """
+    # rows for a MAC Address or license ID only match devices by that column
+    LOOKUPS: tuple = (
+        ("mac", "mac = ?"),
+        ("lic_id", "lic_id = ? AND mac IS NULL"),
+        ("model", "model = ? AND mac IS NULL AND lic_id IS NULL"),
+    )
+    COLUMNS: tuple = ("mac", "lic_id", "model", "firmware", "config", "additional_packages")
+
+    def __init__(self, config: ConfigParser):
+        self.source = config.get("inventory", "source", fallback=None)
+        if not self.source:
+            raise KeyError("[inventory]source= is not defined in the configuration")
+        if not os.path.exists(self.source):
+            raise ValueError(f"The inventory {self.source!r} does not exist")
+        self.database = config.get("inventory", "database", fallback=f"{self.source}.sqlite")
+        self.firmware = config.get("inventory", "firmware", fallback=None)
+        self.default_config = config.get("inventory", "config", fallback=None)
+        self.version = None
+        self.failed = None
+        self.lock = threading.Lock()
+        # flashes run in several threads, the lock serializes the use of the connection
+        self.db = sqlite3.connect(self.database, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS devices (
+                key TEXT PRIMARY KEY, digest TEXT NOT NULL,
+                mac TEXT, lic_id TEXT, model TEXT,
+                firmware TEXT, config TEXT, additional_packages TEXT
+            );
+            CREATE INDEX IF NOT EXISTS devices_mac ON devices (mac);
+            CREATE INDEX IF NOT EXISTS devices_lic_id ON devices (lic_id);
+            CREATE INDEX IF NOT EXISTS devices_model ON devices (model);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+        """)
+        row = self.db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        if row:
+            self.version = tuple(json.loads(row[0]))
+        self.update()
+
+    def get_files(self, info: InterfaceInfo) -> tuple[str]:
+        """
+        The files of the device from the row matching its MAC Address, license
+        ID or model (in this order, see `LOOKUPS`), the defaults if no row matches
+
+        Arguments
+        ---------
+
+        info : InterfaceInfo
+            Information about the Device (MAC Address, Model, Architecture, min OS, Licence)
+
+        Returns
+        -------
+
+         - Tuple of the path to the .npk files and .rsc config
+        """
+        self.update()
+        with self.lock:
+            row = None
+            values = {"mac": info.mac.hex(":"), "lic_id": info.lic_id, "model": info.model}
+            for column, condition in self.LOOKUPS:
+                if values[column]:
+                    row = self.db.execute(f"SELECT firmware, config, additional_packages FROM devices WHERE {condition} "
+                                          "ORDER BY key LIMIT 1", (values[column],)).fetchone()
+                if row:
+                    break
+        firmware, rsc, packages = row or (None, None, None)
+        return firmware or self.firmware, *(packages or "").split(), rsc or self.default_config
+
+    def update(self) -> None:
+        """
+        Index the `source` again if its modification time or size changed.
+        Rows that did not change are kept, changed rows are replaced and
+        removed rows are deleted, all in one transaction.
+
+        If the `source` can not be read once it was indexed, the error is
+        logged and the previous index is kept until the `source` changes again.
+
+        Raises
+        ------
+
+        ValueError
+            The `source` can not be read and was never indexed
+        """
+        try:
+            info = os.stat(self.source)
+        except OSError:
+            # keep the index of a removed inventory
+            return
+        version = (info.st_mtime_ns, info.st_size)
+        if version in (self.version, self.failed):
+            return
+        with self.lock:
+            if version in (self.version, self.failed):
+                return
+            try:
+                source = self._read()
+            except ValueError as e:
+                if self.version is None:
+                    raise
+                # e.g. a half written inventory, the next change is read again
+                self.failed = version
+                logging.getLogger("pynet-err").error("%s, keeping the previous inventory", e)
+                return
+            self.failed = None
+            rows = {}
+            for row in source:
+                row = self._normalize(row)
+                key = row["mac"] or (row["lic_id"] and f"lic_id:{row['lic_id']}") or (row["model"] and f"model:{row['model']}")
+                if key:
+                    digest = hashlib.sha256(json.dumps([row[column] for column in self.COLUMNS]).encode()).hexdigest()
+                    rows[key] = (digest, row)
+
+            indexed = dict(self.db.execute("SELECT key, digest FROM devices"))
+            changed = [(key, digest, *(row[column] for column in self.COLUMNS))
+                       for key, (digest, row) in rows.items() if indexed.get(key) != digest]
+            removed = [(key,) for key in indexed if key not in rows]
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO devices VALUES (?, ?, ?, ?, ?, ?, ?, ?)", changed)
+                self.db.executemany("DELETE FROM devices WHERE key = ?", removed)
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (json.dumps(version),))
+            self.version = version
+
+    def close(self) -> None:
+        """
+        Close the database, called when the Plugin is replaced by a changed configuration
+        """
+        with self.lock:
+            self.db.close()
+
+    def _read(self) -> list[dict]:
+        """
+        The rows of the `source`, from a JSON list of objects or a CSV file with a header row
+        """
+        try:
+            with open(self.source, newline="") as f:
+                if self.source.lower().endswith(".json"):
+                    rows = json.load(f)
+                    rows = rows["devices"] if isinstance(rows, dict) else rows
+                    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                        raise ValueError("expected a list of objects")
+                    return rows
+                return list(csv.DictReader(f))
+        except (OSError, ValueError, KeyError, TypeError, csv.Error) as e:
+            raise ValueError(f"The inventory {self.source!r} can not be read: {e}")
+
+    def _normalize(self, row: dict) -> dict:
+        """
+        The `COLUMNS` of a row as stripped strings or None, the MAC Address
+        as lower case hex separated by colons and relative paths resolved
+        against the directory of the `source`
+        """
+        row = {column: (str(row.get(column) or "").strip() or None) for column in self.COLUMNS}
+        if row["mac"]:
+            digits = "".join(c for c in row["mac"].lower() if c in "0123456789abcdef")
+            row["mac"] = ":".join(digits[i:i + 2] for i in range(0, len(digits), 2))
+        directory = os.path.dirname(os.path.abspath(self.source))
+        for column in ("firmware", "config"):
+            if row[column] and "://" not in row[column]:
+                row[column] = os.path.join(directory, row[column])
+        if row["additional_packages"]:
+            row["additional_packages"] = " ".join(package if "://" in package else os.path.join(directory, package)
+                                                  for package in row["additional_packages"].split())
+        return row
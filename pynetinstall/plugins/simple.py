@@ -44,7 +44,7 @@ class Plugin:
             raise ValueError(f"The firmware file {self.firmware!r} does not exist")
         if self.default_config and not os.path.exists(self.default_config):
             raise ValueError(f"The config file {self.default_config!r} does not exist")
-        self.additional_packages = additional_packages.splitlines()
+        self.additional_packages = [pkg for pkg in additional_packages.splitlines() if pkg]
         for pkg in self.additional_packages:
             if not os.path.exists(pkg):
                 raise ValueError(f"The package {pkg} does not exist")
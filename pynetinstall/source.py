@@ -0,0 +1,433 @@
+import os
+import mmap
+import stat
+import time
+import shutil
+import tempfile
+import threading
+import collections
+
+
+class ReadAhead:
+    """
+    Reads a file object in a background thread, so reading from slow sources
+    (HTTP, SD cards) does not delay the chunks sent to the device.
+
+    The thread keeps up to `depth` bytes buffered in blocks of `block_size`
+    bytes; read() returns memoryviews of these blocks without copying them,
+    unless the requested bytes span two blocks. With `spool` the thread does
+    not wait once `depth` bytes are buffered but writes the following blocks
+    to a temporary file, so a download completes as fast as the server sends it.
+
+    Attributes
+    ----------
+
+    file : object
+        The file object to read from (anything with a .read() function)
+    depth : int
+        How many bytes are read ahead at most, 0 to read synchronously without a thread (default: 512 kB)
+    block_size : int
+        How many bytes are read from the `file` at once (default: 64 kB)
+    spool : bool
+        Write the blocks beyond `depth` to a temporary file instead of waiting (default: False)
+    waits : int
+        How often read() had to wait for the `file`
+    wait_time : float
+        The time in seconds read() spent waiting for the `file`
+
+    Methods
+    -------
+
+    read(size=-1) -> bytes or memoryview
+        Read `size` bytes, or everything until the end of the file
+
+    peek(size) -> bytes
+        Return up to `size` bytes without consuming them, across blocks
+
+    close() -> None
+        Stop reading ahead and close the `file`
+    """
+    def __init__(self, file, depth: int = 512 * 1024, block_size: int = 64 * 1024, spool: bool = False) -> None:
+        self.file = file
+        self.depth = depth
+        self.block_size = block_size
+        self.spool = spool
+        # the blocks beyond `depth` when spooling, read back once the buffered blocks are consumed
+        self.spill = None
+        self.spilled = 0
+        self.unspilled = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.blocks = collections.deque()
+        self.buffered = 0
+        self.current = b""
+        self.offset = 0
+        self.eof = False
+        self.error = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = None
+        if depth > 0:
+            self.thread = threading.Thread(target=self._fill, name="read-ahead", daemon=True)
+            self.thread.start()
+
+    def _fill(self) -> None:
+        """
+        Read blocks from the `file` until it is exhausted or the ReadAhead is closed
+        """
+        while True:
+            with self.condition:
+                while self.buffered >= self.depth and not self.spool and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+            try:
+                block = self.file.read(self.block_size)
+            except Exception as e:
+                block, self.error = b"", e
+            with self.condition:
+                if self.closed:
+                    return
+                # once spilled, the following blocks are spilled too until they are read back, to keep their order
+                if block and (self.spilled > self.unspilled or self.buffered >= self.depth):
+                    try:
+                        if self.spill is None:
+                            self.spill = tempfile.TemporaryFile()
+                        view = memoryview(block)
+                        while view:
+                            written = os.pwrite(self.spill.fileno(), view, self.spilled)
+                            self.spilled += written
+                            view = view[written:]
+                    except Exception as e:
+                        block, self.error = b"", e
+                        self.eof = True
+                elif block:
+                    self.blocks.append(block)
+                    self.buffered += len(block)
+                else:
+                    self.eof = True
+                self.condition.notify_all()
+            if not block:
+                return
+
+    def _next_block(self) -> bool:
+        """
+        Make the next buffered block the `current` one, waiting for the thread if necessary
+
+        Returns
+        -------
+
+         - bool: False at the end of the file
+        """
+        if self.thread is None:
+            block = self.file.read(self.block_size)
+            if not block:
+                return False
+            self.current, self.offset = memoryview(block), 0
+            return True
+        with self.condition:
+            if not self.blocks and self.unspilled >= self.spilled and not self.eof:
+                self.waits += 1
+                started = time.monotonic()
+                while not self.blocks and self.unspilled >= self.spilled and not self.eof:
+                    self.condition.wait()
+                self.wait_time += time.monotonic() - started
+            if self.error:
+                raise self.error
+            if self.blocks:
+                self.current, self.offset = memoryview(self.blocks.popleft()), 0
+                self.buffered -= len(self.current)
+                self.condition.notify_all()
+                return True
+            if self.unspilled >= self.spilled:
+                return False
+            offset, size = self.unspilled, min(self.block_size, self.spilled - self.unspilled)
+        # the spilled bytes before `spilled` are not written again, they are read without the lock
+        block = os.pread(self.spill.fileno(), size, offset)
+        with self.condition:
+            self.unspilled += len(block)
+            self.condition.notify_all()
+        self.current, self.offset = memoryview(block), 0
+        return True
+
+    def read(self, size: int = -1) -> bytes or memoryview:
+        """
+        Read `size` bytes, fewer only at the end of the file
+
+        Arguments
+        ---------
+
+        size : int
+            How many bytes to read, negative to read until the end of the file (default: -1)
+        """
+        parts = []
+        while size != 0:
+            if self.offset >= len(self.current) and not self._next_block():
+                break
+            end = len(self.current) if size < 0 else min(len(self.current), self.offset + size)
+            parts.append(self.current[self.offset:end])
+            size -= (end - self.offset) if size > 0 else 0
+            self.offset = end
+        if len(parts) == 1:
+            return parts[0]
+        return b"".join(parts)
+
+    def peek(self, size: int) -> bytes:
+        """
+        Return up to `size` bytes without consuming them, fewer only if the
+        end of the file is reached. Bytes beyond the current block are joined
+        into it.
+        """
+        if self.offset >= len(self.current) and not self._next_block():
+            return b""
+        while len(self.current) - self.offset < size:
+            rest = self.current[self.offset:]
+            if not self._next_block():
+                break
+            self.current, self.offset = memoryview(b"".join((rest, self.current))), 0
+        return bytes(self.current[self.offset:self.offset + size])
+
+    def close(self) -> None:
+        """
+        Stop reading ahead and close the `file`
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.file.close()
+        with self.condition:
+            if self.spill is not None:
+                self.spill.close()
+
+
+class MappedFile:
+    """
+    Reads a file mapped into memory by `MappedStore`
+
+    read() returns memoryviews of the mapping without copying, so processes
+    forked after the file was mapped send the same physical pages.
+
+    Attributes
+    ----------
+
+    buffer : mmap.mmap or bytes
+        The mapped file
+    position : int
+        Where the next read() starts
+    waits : int
+        Always 0, the file is never waited for (see ReadAhead)
+    wait_time : float
+        Always 0
+
+    Methods
+    -------
+
+    read(size=-1) -> memoryview
+        Read `size` bytes, or everything until the end of the file
+
+    peek(size) -> bytes
+        Return up to `size` bytes without consuming them
+
+    close() -> None
+        Stop reading, the mapping stays valid for other MappedFiles
+    """
+    waits: int = 0
+    wait_time: float = 0.0
+
+    def __init__(self, buffer: mmap.mmap or bytes) -> None:
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.position = 0
+
+    def read(self, size: int = -1) -> memoryview:
+        """
+        Read `size` bytes, fewer only at the end of the file
+        """
+        end = len(self.view) if size < 0 else min(len(self.view), self.position + size)
+        data = self.view[self.position:end]
+        self.position = end
+        return data
+
+    def peek(self, size: int) -> bytes:
+        """
+        Return up to `size` bytes without consuming them
+        """
+        return bytes(self.view[self.position:self.position + size])
+
+    def close(self) -> None:
+        """
+        Stop reading, the mapping is unmapped once no MappedFile uses it
+        """
+        self.view = self.view[:0]
+
+
+class MappedStore:
+    """
+    Maps the files of the flashes into memory once, so worker processes
+    forked afterwards share one copy of every file instead of reading their own.
+
+    Regular files (local firmware, files of the `FirmwareCache`) are mapped
+    directly and reused while their size and modification time do not
+    change. Other sources (HTTP responses, pipes) are copied into an
+    anonymous temporary file first. The copy of a source staged by its URL
+    (see stage()) is shared by the flashes of the next `max_age` seconds,
+    so devices discovered together download it once.
+
+    Attributes
+    ----------
+
+    maps : dict[tuple[int, int], tuple[tuple[int, int], mmap.mmap]]
+        The mapped regular files by device and inode, with their modification time and size
+    copies : dict[str, tuple[float, mmap.mmap or bytes, str, int]]
+        The copied sources by their URL, with the time they were copied, their name and size
+    max_age : float
+        How many seconds a copied source is shared (default: 60)
+
+    Methods
+    -------
+
+    open(file, check=None) -> MappedFile
+        Map the `file` into memory and close it
+
+    stage(key, resolve, check=None) -> tuple[MappedFile, str, int]
+        Map the file of the source `key`, resolving it only if it is not copied yet
+    """
+    HEADER_SIZE: int = 64
+
+    def __init__(self, max_age: float = 60) -> None:
+        self.max_age = max_age
+        self.maps: dict[tuple[int, int], tuple[tuple[int, int], mmap.mmap]] = {}
+        self.copies: dict[str, tuple[float, mmap.mmap or bytes, str, int]] = {}
+        self.key_locks: dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+
+    def open(self, file, check=None) -> MappedFile:
+        """
+        Map the `file` into memory and close it
+
+        Arguments
+        ---------
+
+        file : object
+            The file object to map (anything with a .read() function)
+        check : callable
+            Called with the first `HEADER_SIZE` bytes of the file before it
+            is copied, raises to reject the file (default: None)
+        """
+        return MappedFile(self._map(file, check)[0])
+
+    def stage(self, key: str, resolve, check=None) -> tuple[MappedFile, str, int]:
+        """
+        Map the file of the source `key` (e.g. a URL) into memory. A copy of
+        the source younger than `max_age` seconds is shared, else the file
+        is resolved and mapped with open(). Flashes staging the same `key` at
+        the same time wait for the first one.
+
+        Arguments
+        ---------
+
+        key : str
+            The source of the file, None to not share it
+        resolve : callable
+            Returns the file object, name and size of the source
+        check : callable
+            Called with the first `HEADER_SIZE` bytes of the file, see open() (default: None)
+
+        Returns
+        -------
+
+         - MappedFile: The file
+         - str: The name of the file
+         - int: The size of the file
+        """
+        if key is None:
+            file, name, size = resolve()
+            return self.open(file, check), name, size
+        now = time.monotonic()
+        with self.lock:
+            for expired in [source for source, (copied, *_) in self.copies.items() if now - copied >= self.max_age]:
+                del self.copies[expired]
+                self.key_locks.pop(expired, None)
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.lock:
+                copy = self.copies.get(key)
+            if copy is not None:
+                _, buffer, name, size = copy
+                file = MappedFile(buffer)
+                if check is not None:
+                    check(file.peek(self.HEADER_SIZE))
+                return file, name, size
+            file, name, size = resolve()
+            buffer, copied = self._map(file, check)
+            with self.lock:
+                if copied:
+                    self.copies[key] = (time.monotonic(), buffer, name, size)
+                elif key not in self.copies:
+                    # regular files are shared by their inode, see open()
+                    self.key_locks.pop(key, None)
+            return MappedFile(buffer), name, size
+
+    def _map(self, file, check=None) -> tuple[mmap.mmap or bytes, bool]:
+        """
+        Map the `file` into memory and close it, see open()
+
+        Returns
+        -------
+
+         - mmap.mmap or bytes: The mapped file
+         - bool: Whether the file had to be copied (it is not a regular file)
+        """
+        with file:
+            try:
+                info = os.fstat(file.fileno())
+            except (AttributeError, OSError, ValueError):
+                info = None
+            if info is not None and stat.S_ISREG(info.st_mode):
+                if info.st_size == 0:
+                    buffer = b""
+                else:
+                    key, version = (info.st_dev, info.st_ino), (info.st_mtime_ns, info.st_size)
+                    with self.lock:
+                        if key not in self.maps or self.maps[key][0] != version:
+                            # a replaced mapping is unmapped by the garbage collector once no MappedFile uses it
+                            self.maps[key] = (version, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+                        buffer = self.maps[key][1]
+                if check is not None:
+                    check(bytes(buffer[:self.HEADER_SIZE]))
+                return buffer, False
+
+            header = file.read(self.HEADER_SIZE)
+            if check is not None:
+                check(bytes(header))
+            with tempfile.TemporaryFile() as copy:
+                copy.write(header)
+                shutil.copyfileobj(file, copy, 1024 * 1024)
+                if copy.tell() == 0:
+                    return b"", True
+                copy.flush()
+                return mmap.mmap(copy.fileno(), 0, access=mmap.ACCESS_READ), True
+
+
+def is_regular_file(file) -> bool:
+    """
+    Whether the file object `file` reads a regular file (e.g. not an HTTP response or a pipe)
+    """
+    try:
+        return stat.S_ISREG(os.fstat(file.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+def url_file_name(url: str, response) -> str:
+    """
+    The name of the file behind `url`, as provided by the server in the
+    Content-Disposition header of the `response` or taken from the URL
+    """
+    try: # use server provided file name if available
+        name = response.getheader("Content-Disposition")
+        name = name.split("=")[1]
+    except: # extract basename from URL
+        _, _, name = url.rpartition('/')
+        name, _, _ = name.partition('?')
+    return name